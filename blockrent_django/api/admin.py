@@ -1,5 +1,5 @@
 from django.contrib import admin
-from api.models import User, Application, Event, Registration, AppFilter
+from api.models import User, Application, Event, ArchivedEvent, Registration, AppFilter, OutboundEmail
 
 
 # Register your models here.
@@ -14,8 +14,15 @@ class ApplicationAdmin(admin.ModelAdmin):
     list_filter = ('status', )
 
 
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'to', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', )
+
+
 admin.site.register(User, UserAdmin)
 admin.site.register(Application, ApplicationAdmin)
 admin.site.register(Event)
+admin.site.register(ArchivedEvent)
 admin.site.register(Registration)
-admin.site.register(AppFilter)
\ No newline at end of file
+admin.site.register(AppFilter)
+admin.site.register(OutboundEmail, OutboundEmailAdmin)
\ No newline at end of file
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        # connect the signal handlers keeping caches and derived tables in sync
+        import api.core.authentication  # noqa
+        import api.core.etags  # noqa
+        import api.core.filters  # noqa
+        import api.core.search  # noqa
+        import api.core.summary  # noqa
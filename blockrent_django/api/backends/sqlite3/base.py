@@ -0,0 +1,26 @@
+"""
+SQLite engine for running the API on a single database file under concurrent
+writes. New connections get the SQLITE_PRAGMAS of the settings (WAL journal,
+busy timeout, mmap, ...) and transactions start with ``BEGIN IMMEDIATE``, so
+writers take the write lock up front and wait for each other for
+busy_timeout instead of failing with "database is locked" when a deferred
+read transaction tries to upgrade.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+connection_created.connect(apply_pragmas, sender=DatabaseWrapper)
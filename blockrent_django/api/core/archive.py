@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.core.live import EVENT_FIELDS, event_rows
+from api.models import ArchivedEvent, Event
+
+TERMINAL_STATUSES = ('HANDLED', 'IGNORED')
+
+
+def archivable_events(now=None):
+    """
+    Events older than EVENT_ARCHIVE_AFTER_DAYS, and HANDLED/IGNORED ones older
+    than EVENT_ARCHIVE_TERMINAL_AFTER_DAYS
+    """
+    now = now or timezone.now()
+    return Event.objects.filter(
+        Q(when__lt=now - timedelta(days=settings.EVENT_ARCHIVE_AFTER_DAYS)) |
+        Q(status__in=TERMINAL_STATUSES, when__lt=now - timedelta(days=settings.EVENT_ARCHIVE_TERMINAL_AFTER_DAYS)))
+
+
+def archive_events(chunk_size=500, now=None):
+    """
+    Moves the archivable events into ArchivedEvent, chunk by chunk in primary
+    key order.
+
+    Every chunk is copied and deleted in one transaction, an interrupted run
+    loses nothing and can simply be started again. Yields ``(last_id, archived)``
+    per chunk.
+    """
+    pending = archivable_events(now).order_by('pk')
+    after = 0
+    while True:
+        with transaction.atomic():
+            rows = list(pending.filter(pk__gt=after).values(*EVENT_FIELDS)[:chunk_size])
+            if not rows:
+                return
+            ArchivedEvent.objects.bulk_create([ArchivedEvent(**row) for row in rows])
+            Event.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        after = rows[-1]['id']
+        yield after, len(rows)
+
+
+def event_history(referenceid, limit, after=None):
+    """
+    Events of ``referenceid``, newest first, from both the Event table and the
+    archive, older than the id ``after`` when given. Returns the rows, marked
+    ``archived``, and whether older ones follow.
+    """
+    rows = []
+    for model, archived in ((Event, False), (ArchivedEvent, True)):
+        events = model.objects.filter(referenceid=referenceid)
+        if after is not None:
+            events = events.filter(pk__lt=after)
+        for row in event_rows(events.order_by('-pk')[:limit + 1]):
+            row['archived'] = archived
+            rows.append(row)
+    rows.sort(key=lambda row: row['id'], reverse=True)
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,116 @@
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from queue import Queue, Empty, Full
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+
+from api.core.live import get_notifier
+from api.models import Event
+
+logger = logging.getLogger(__name__)
+
+
+class AuditSink(object):
+    """
+    Buffers the audit Events of a unit of work and writes them with a single
+    ``bulk_create`` on ``flush``.
+
+    Events recorded with ``critical=False`` are handed to the background
+    AsyncAuditWriter once the transaction commits when AUDIT_ASYNC_EVENTS is
+    on, otherwise they are written with the rest of the buffer.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.deferred = []
+
+    def record(self, referenceid, what, who, critical=True):
+        event = Event(referenceid=referenceid, what=what, who=who)
+        if critical or not settings.AUDIT_ASYNC_EVENTS:
+            self.events.append(event)
+        else:
+            self.deferred.append(event)
+        return event
+
+    def flush(self):
+        events, self.events = self.events, []
+        if events:
+            Event.objects.bulk_create(events)
+            transaction.on_commit(get_notifier().notify)
+
+        deferred, self.deferred = self.deferred, []
+        if deferred:
+            transaction.on_commit(lambda: get_async_writer().submit(deferred))
+
+
+@contextmanager
+def audit_events():
+    """
+    Collects the events recorded in the block and flushes them at its end, use
+    it as the last thing inside ``transaction.atomic`` so the events commit
+    together with the change they describe
+    """
+    sink = AuditSink()
+    yield sink
+    sink.flush()
+
+
+class AsyncAuditWriter(threading.Thread):
+    """
+    Background thread writing non-critical events in batches. When the queue is
+    full events are written synchronously rather than dropped.
+    """
+
+    def __init__(self, batch_size=200, interval=1.0, max_queue=10000):
+        super(AsyncAuditWriter, self).__init__(name='audit-writer', daemon=True)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = Queue(maxsize=max_queue)
+
+    def submit(self, events):
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except Full:
+                Event.objects.bulk_create([event])
+                get_notifier().notify()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except Empty:
+                    break
+            try:
+                Event.objects.bulk_create(batch)
+                get_notifier().notify()
+            except Exception:
+                logger.exception('failed to write %s audit events', len(batch))
+            finally:
+                close_old_connections()
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self):
+        self.queue.join()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_async_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AsyncAuditWriter(batch_size=settings.AUDIT_ASYNC_BATCH_SIZE)
+            _writer.start()
+            atexit.register(_writer.flush)
+    return _writer
@@ -0,0 +1,120 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from tastypie.authentication import ApiKeyAuthentication
+from tastypie.models import ApiKey
+
+from api.models import User
+
+
+class LRUCache(object):
+    """
+    Thread safe LRU cache whose entries expire ``ttl`` seconds after they're set
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate):
+        with self._lock:
+            for key in [key for key, (value, expires) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+api_key_cache = LRUCache(max_size=settings.API_KEY_CACHE_SIZE, ttl=settings.API_KEY_CACHE_TTL)
+
+
+class CachedApiKeyAuthentication(ApiKeyAuthentication):
+    """
+    ApiKeyAuthentication that remembers the user of a (username, api key)
+    pair in process for API_KEY_CACHE_TTL seconds, so repeated requests skip
+    the auth_user/tastypie_apikey lookup. Entries are dropped when the key is
+    regenerated or the user's active state/status changes.
+    """
+
+    def is_authenticated(self, request, **kwargs):
+        try:
+            username, api_key = self.extract_credentials(request)
+        except ValueError:
+            return self._unauthorized()
+
+        if not username or not api_key:
+            return self._unauthorized()
+
+        user = api_key_cache.get((username, api_key))
+        if user is not None:
+            request.user = copy.copy(user)
+            return True
+
+        result = super(CachedApiKeyAuthentication, self).is_authenticated(request, **kwargs)
+        if result is True:
+            api_key_cache.set((username, api_key), copy.copy(request.user))
+        return result
+
+
+def invalidate_user(user_id):
+    api_key_cache.invalidate(lambda key, user: user.pk == user_id)
+
+
+@receiver(post_save, sender=ApiKey)
+@receiver(post_delete, sender=ApiKey)
+def api_key_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields is None or {'is_active', 'account_status', 'username'} & set(update_fields):
+        invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
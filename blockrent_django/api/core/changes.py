@@ -0,0 +1,12 @@
+def saved_changes(instance, columns, attribute, created, update_fields):
+    """
+    Whether a save wrote new values to ``columns``, compared with the values
+    of the last save (kept on the instance in ``attribute``) or the ones
+    loaded from the database
+    """
+    if update_fields is not None and not set(columns) & set(update_fields):
+        return False
+    values = dict((column, getattr(instance, column)) for column in columns)
+    previous = getattr(instance, attribute, None) or getattr(instance, '_loaded_values', None) or {}
+    setattr(instance, attribute, values)
+    return created or any(column not in previous or previous[column] != value for column, value in values.items())
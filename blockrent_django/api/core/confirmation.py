@@ -0,0 +1,111 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from api.core.audit import audit_events
+from api.core.summary import SUMMARY_FIELDS, contributions, apply_delta
+from api.models import Application
+
+CONFIRMATION_FIELDS = (
+    ('tenant', 'tenant_id', 'is_confirmed_by_tenant'),
+    ('owner', 'owner_id', 'is_confirmed_by_owner'),
+)
+
+## what a confirmation's UPDATE requires to be unchanged since the row was read
+STATE_FIELDS = dict((role, (account_field, 'is_confirmed_by_tenant', 'is_confirmed_by_owner', 'status'))
+                    for role, account_field, confirmed_field in CONFIRMATION_FIELDS)
+
+NOT_FOUND = 'not_found'
+NOT_A_PARTY = 'not_a_party'
+ALREADY_CONFIRMED = 'already_confirmed'
+CONFIRMED = 'confirmed'
+## the application changed between reading and updating it, confirm it again
+CONFLICT = 'conflict'
+
+
+class StateChanged(Exception):
+    pass
+
+
+def confirmation_change(values, account_id):
+    """
+    The role of ``account_id`` in the application ``values`` (its SUMMARY_FIELDS)
+    and the fields its confirmation changes, None when it already confirmed.
+    The status moves to CONFIRMED together with the second confirmation.
+    """
+    for role, account_field, confirmed_field in CONFIRMATION_FIELDS:
+        if values[account_field] != account_id:
+            continue
+        if values[confirmed_field] == 'YES':
+            return role, None
+        changes = {confirmed_field: 'YES'}
+        other_field = 'is_confirmed_by_owner' if role == 'tenant' else 'is_confirmed_by_tenant'
+        if values[other_field] == 'YES' and values['status'] != 'CONFIRMED':
+            changes['status'] = 'CONFIRMED'
+        return role, changes
+    return None, None
+
+
+def confirm_applications(internal_ids, account_id):
+    """
+    Confirms the applications for the party ``account_id`` in one transaction.
+
+    The rows are read locked (select_for_update, SQLite serializes writers with
+    BEGIN IMMEDIATE) and changed with conditional UPDATEs of just the changed
+    fields, matching only rows still in the state they were read in, so
+    concurrent confirmations by the tenant and the owner can't overwrite each
+    other. Rows in the same state are updated with one statement, which also
+    moves them to CONFIRMED. Should a group no longer match (a database
+    without row locks), its UPDATE is rolled back and its applications get the
+    CONFLICT outcome instead of failing the whole request. Returns
+    ``{internal_id: outcome}``, the outcome tells whether the confirmation and
+    the transition to CONFIRMED happened.
+    """
+    internal_ids = list(dict.fromkeys(internal_ids))
+    results = dict((internal_id, {'status': NOT_FOUND}) for internal_id in internal_ids)
+
+    with transaction.atomic(), audit_events() as audit:
+        rows = Application.objects.select_for_update().filter(internal_id__in=internal_ids) \
+            .values('pk', 'internal_id', *SUMMARY_FIELDS)
+
+        groups = defaultdict(list)
+        for row in rows:
+            role, changes = confirmation_change(row, account_id)
+            if role is None:
+                results[row['internal_id']] = {'status': NOT_A_PARTY, 'application_status': row['status']}
+            elif changes is None:
+                results[row['internal_id']] = {'status': ALREADY_CONFIRMED, 'role': role,
+                                               'application_status': row['status']}
+            else:
+                state = tuple((field, row[field]) for field in STATE_FIELDS[role])
+                groups[(state, tuple(sorted(changes.items())))].append((role, row))
+
+        now = timezone.now()
+        delta = Counter()
+        for (state, changes), rows in groups.items():
+            changes = dict(changes)
+            try:
+                with transaction.atomic():
+                    updated = Application.objects.filter(pk__in=[row['pk'] for role, row in rows], **dict(state)) \
+                        .update(updated_at=now, **changes)
+                    if updated != len(rows):
+                        raise StateChanged()
+            except StateChanged:
+                for role, row in rows:
+                    results[row['internal_id']] = {'status': CONFLICT, 'role': role}
+                continue
+
+            for role, row in rows:
+                new_values = dict(row, **changes)
+                delta.update(contributions(new_values))
+                delta.subtract(contributions(row))
+                results[row['internal_id']] = {
+                    'status': CONFIRMED, 'role': role, 'application_status': new_values['status'],
+                    'transitioned': new_values['status'] != row['status'],
+                }
+                audit.record(referenceid=row['internal_id'], what="APPLICATION CONFIRMATION", who=account_id)
+
+        ## confirmation doesn't touch the columns of saved filters or the search index
+        apply_delta(delta)
+    return results
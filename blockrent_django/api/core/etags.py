@@ -0,0 +1,48 @@
+import hashlib
+
+from django.db.models import Count, Max, Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.models import User, Application
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def etag_matches(request, etag):
+    """
+    True when ``etag`` is listed in the request's If-None-Match header
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def application_etag(pk, updated_at, format):
+    return make_etag('application', pk, updated_at.isoformat(), format)
+
+
+def collection_etag(objects, request, format):
+    """
+    Version of a list response: the newest updated_at and the row count of the
+    filtered queryset (which catches deletes) plus the query string
+    """
+    version = objects.order_by().aggregate(last=Max('updated_at'), count=Count('id'))
+    last = version['last'].isoformat() if version['last'] else ''
+    return make_etag('applications', last, version['count'], sorted(request.GET.lists()), format)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    ## application representations embed the party details, a changed party changes their version
+    if raw or created:
+        return
+    if update_fields is not None and not {'first_name', 'last_name', 'contact_number', 'email'} & set(update_fields):
+        return
+    Application.objects.filter(Q(tenant_id=instance.account_id) | Q(owner_id=instance.account_id)) \
+        .update(updated_at=timezone.now())
@@ -0,0 +1,63 @@
+import csv
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iter_chunks(queryset, chunk_size):
+    """
+    Walks ``queryset`` (``values()`` rows including ``id``) in primary key
+    order, ``chunk_size`` rows per query, so only one chunk is held in memory
+    """
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]['id']
+
+
+class Echo(object):
+    """
+    File-like object handing back what csv.writer writes to it
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(rows, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([export_value(row[field]) for field in fields])
+
+
+def ndjson_lines(rows, fields):
+    for row in rows:
+        yield json.dumps(dict((field, row[field]) for field in fields), cls=DjangoJSONEncoder) + '\n'
+
+
+def stream_export(rows, fields, export_format, filename):
+    lines = csv_lines(rows, fields) if export_format == 'csv' else ndjson_lines(rows, fields)
+    response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (filename, export_format)
+    return response
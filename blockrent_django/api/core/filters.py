@@ -0,0 +1,182 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from api.core.changes import saved_changes
+from api.models import User, Application, AppFilter, AppFilterResult
+
+
+def name_query(name):
+    """
+    Users whose first or last name contains every word of ``name``
+    """
+    query = Q()
+    for word in name.split():
+        query &= Q(first_name__icontains=word) | Q(last_name__icontains=word)
+    return User.objects.filter(query).values('account_id')
+
+
+def parse_filter_date(value):
+    date = parse_date(value[:10])
+    if date is None:
+        raise ValueError('invalid date %r' % value)
+    return date
+
+
+## the Application columns filters select on, saves not changing them leave the results as they are
+FILTER_COLUMNS = ('property_usage', 'property_size', 'tenant_id', 'owner_id', 'start_date', 'end_date', 'address')
+
+
+def filter_criteria(app_filter):
+    """
+    The criteria of a saved AppFilter as ``(column, lookup, value)``, the
+    ``name`` lookup matches the party's first or last name by account id
+    """
+    criteria = []
+    if app_filter.property_type:
+        criteria.append(('property_usage', 'exact', app_filter.property_type))
+    if app_filter.property_size_from:
+        criteria.append(('property_size', 'gte', app_filter.property_size_from))
+    if app_filter.property_size_to:
+        criteria.append(('property_size', 'lte', app_filter.property_size_to))
+    if app_filter.tenant_name:
+        criteria.append(('tenant_id', 'name', app_filter.tenant_name))
+    if app_filter.owner_name:
+        criteria.append(('owner_id', 'name', app_filter.owner_name))
+    if app_filter.start_date:
+        criteria.append(('start_date', 'gte', parse_filter_date(app_filter.start_date)))
+    if app_filter.end_date:
+        criteria.append(('end_date', 'lte', parse_filter_date(app_filter.end_date)))
+    if app_filter.address:
+        criteria.append(('address', 'icontains', app_filter.address))
+    return criteria
+
+
+def compile_filter(app_filter):
+    """
+    Compiles the criteria of a saved AppFilter into a single Q over Application,
+    party names are matched with a subquery on the indexed User.account_id
+    """
+    query = Q()
+    for column, lookup, value in filter_criteria(app_filter):
+        if lookup == 'name':
+            query &= Q(**{'%s__in' % column: name_query(value)})
+        else:
+            query &= Q(**{'%s__%s' % (column, lookup): value})
+    return query
+
+
+def matches(criteria, row, names):
+    """
+    Evaluates ``filter_criteria`` on an Application ``values()`` row the way
+    compile_filter's query does, ``names`` maps account ids to (first, last)
+    """
+    for column, lookup, expected in criteria:
+        value = row[column]
+        if lookup == 'exact':
+            matched = value == expected
+        elif lookup == 'gte':
+            matched = value is not None and value >= expected
+        elif lookup == 'lte':
+            matched = value is not None and value <= expected
+        elif lookup == 'icontains':
+            matched = expected.lower() in (value or '').lower()
+        else:
+            party = names.get(value)
+            matched = party is not None and all(word.lower() in party[0].lower() or word.lower() in party[1].lower()
+                                                for word in expected.split())
+        if not matched:
+            return False
+    return True
+
+
+def filter_results(app_filter):
+    """
+    Applications matching the filter, heavy filters are read from their
+    materialized results (built on first use)
+    """
+    if not app_filter.is_heavy:
+        return Application.objects.filter(compile_filter(app_filter))
+    if app_filter.materialized_at is None:
+        materialize(app_filter)
+    return Application.objects.filter(filter_results__app_filter=app_filter)
+
+
+@transaction.atomic
+def materialize(app_filter):
+    AppFilterResult.objects.filter(app_filter=app_filter).delete()
+    application_ids = Application.objects.filter(compile_filter(app_filter)).values_list('pk', flat=True)
+    AppFilterResult.objects.bulk_create(
+        [AppFilterResult(app_filter=app_filter, application_id=pk) for pk in application_ids.iterator()])
+    app_filter.materialized_at = timezone.now()
+    AppFilter.objects.filter(pk=app_filter.pk).update(materialized_at=app_filter.materialized_at)
+
+
+def refresh_materialized_filters(application_ids):
+    """
+    Adds/removes the given applications to/from the results of every
+    materialized filter. The applications and their parties are read once and
+    matched against the filters in memory, so the number of queries doesn't
+    depend on the number of filters or applications.
+    """
+    application_ids = set(application_ids)
+    if not application_ids:
+        return
+    filters = []
+    for app_filter in AppFilter.objects.filter(materialized_at__isnull=False):
+        try:
+            filters.append((app_filter.pk, filter_criteria(app_filter)))
+        except ValueError:
+            continue
+    if not filters:
+        return
+
+    rows = list(Application.objects.filter(pk__in=application_ids).values('pk', *FILTER_COLUMNS))
+    names = {}
+    if any(lookup == 'name' for pk, criteria in filters for column, lookup, value in criteria):
+        account_ids = set(row[column] for row in rows for column in ('tenant_id', 'owner_id'))
+        names = dict((account_id, (first_name, last_name)) for account_id, first_name, last_name in
+                     User.objects.filter(account_id__in=account_ids).values_list('account_id', 'first_name',
+                                                                                 'last_name'))
+    matching = set((filter_pk, row['pk']) for row in rows for filter_pk, criteria in filters
+                   if matches(criteria, row, names))
+
+    present = dict(((filter_pk, application_id), pk) for pk, filter_pk, application_id in AppFilterResult.objects
+                   .filter(app_filter__materialized_at__isnull=False, application_id__in=application_ids)
+                   .values_list('pk', 'app_filter_id', 'application_id'))
+    stale = [pk for pair, pk in present.items() if pair not in matching]
+    if stale:
+        AppFilterResult.objects.filter(pk__in=stale).delete()
+    AppFilterResult.objects.bulk_create([AppFilterResult(app_filter_id=filter_pk, application_id=application_id)
+                                         for filter_pk, application_id in matching if (filter_pk, application_id)
+                                         not in present])
+
+
+def invalidate_filters(queryset):
+    AppFilterResult.objects.filter(app_filter__in=queryset).delete()
+    queryset.update(materialized_at=None)
+
+
+@receiver(post_save, sender=Application)
+def application_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if not raw and saved_changes(instance, FILTER_COLUMNS, '_filter_values', created, update_fields):
+        refresh_materialized_filters([instance.pk])
+
+
+@receiver(post_save, sender=AppFilter)
+def app_filter_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        invalidate_filters(AppFilter.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    ## a renamed party can change whether name filters match its applications
+    if raw or created or not saved_changes(instance, ('first_name', 'last_name'), '_filter_names', created,
+                                           update_fields):
+        return
+    refresh_materialized_filters(Application.objects.filter(
+        Q(tenant_id=instance.account_id) | Q(owner_id=instance.account_id)).values_list('pk', flat=True))
@@ -1,21 +1,31 @@
-from django.core.mail import send_mail, EmailMessage
 from blockrent_django.settings import EMAIL_HOST_USER
-from django.contrib.sites.shortcuts import get_current_site
 from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
+from api.models import OutboundEmail
 from api.tokens import account_activation_token
 
 
-def send_email_notification(email_list):
-    subject = 'Thank you for registering to our site'
-    message = ' it  means a world to us '
-    email_from = EMAIL_HOST_USER
-    recipient_list = email_list
-    send_mail(subject, message, email_from, recipient_list)
+def build_email(subject, message, recipient_list, from_email=EMAIL_HOST_USER):
+    return OutboundEmail(
+        subject=subject,
+        body=message,
+        from_email=from_email or '',
+        to=','.join(recipient_list),
+    )
+
 
+def queue_email(subject, message, recipient_list, from_email=EMAIL_HOST_USER):
+    """
+    Writes the email to the outbox, it's delivered by the process_email_outbox
+    worker once the surrounding transaction commits
+    """
+    email = build_email(subject, message, recipient_list, from_email=from_email)
+    email.save()
+    return email
 
-def send_application_confirm_email(tenant, owner, application):
+
+def build_application_confirm_emails(tenant, owner, application):
     current_site = 'localhost:8080'
     subject = 'Application Confirmation'
     message_tenant = render_to_string('acc_active_application_email.html', {
@@ -33,18 +43,13 @@ def send_application_confirm_email(tenant, owner, application):
         'application': application
     })
 
-    try:
-        send_mail(subject, message_tenant, EMAIL_HOST_USER, [tenant.email, ])
-    except:
-        pass
-
-    try:
-        send_mail(subject, message_owner, EMAIL_HOST_USER, [owner.email, ])
-    except:
-        pass
+    return [
+        build_email(subject, message_tenant, [tenant.email, ]),
+        build_email(subject, message_owner, [owner.email, ]),
+    ]
 
 
-def send_account_creation_email(user, password):
+def build_account_creation_email(user, password):
     current_site = 'localhost:8080'
     subject = 'Thank you for registering to our site'
     message = render_to_string('acc_active_email.html', {
@@ -55,8 +60,4 @@ def send_account_creation_email(user, password):
         'password': password
     })
 
-    email = EmailMessage(subject, message, to=[user.email, ], from_email=EMAIL_HOST_USER)
-    try:
-        email.send()
-    except:
-        pass
+    return build_email(subject, message, [user.email, ])
@@ -0,0 +1,201 @@
+import json
+import logging
+import threading
+import time
+from queue import Queue, Empty, Full
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.db.models import Max, Q
+
+from api.core.parties import PartyResolver
+from api.models import Application, Event
+
+logger = logging.getLogger(__name__)
+
+EVENT_FIELDS = ('id', 'status', 'referenceid', 'what', 'who', 'when')
+
+
+def account_events(account_id):
+    """
+    Events an account follows: the ones it made, the ones about it and the
+    ones about its applications
+    """
+    applications = Application.objects.filter(Q(tenant_id=account_id) | Q(owner_id=account_id)).values('internal_id')
+    return Event.objects.filter(Q(who=account_id) | Q(referenceid=account_id) | Q(referenceid__in=applications))
+
+
+def event_rows(events):
+    """
+    ``values()`` rows of ``events`` with the username of ``who``, the users of
+    the whole batch are loaded at once
+    """
+    rows = list(events.values(*EVENT_FIELDS))
+    resolver = PartyResolver()
+    resolver.prefetch([row['who'] for row in rows])
+    for row in rows:
+        user = resolver.get(row['who'])
+        row['username'] = user.full_name if user is not None else ''
+    return rows
+
+
+class Subscription(object):
+    """
+    Queue of the live events of one stream. ``start_id`` is the last event
+    read by the notifier when it subscribed, later ones reach the queue.
+    """
+
+    def __init__(self, account_id, max_queue):
+        self.account_id = account_id
+        self.queue = Queue(maxsize=max_queue)
+        self.overflowed = False
+        self.start_id = None
+
+    def put(self, row):
+        try:
+            self.queue.put_nowait(row)
+        except Full:
+            ## the client can't keep up, end its stream, it resumes from its last id
+            self.overflowed = True
+
+    def get(self, timeout):
+        if self.overflowed:
+            return None
+        return self.queue.get(timeout=timeout)
+
+
+class EventNotifier(object):
+    """
+    Process wide fan out of new Events to the live streams.
+
+    A single thread reads the events written since the last poll and hands
+    each one to the subscriptions of the accounts following it, so the cost
+    in queries doesn't grow with the number of open streams. It's woken up
+    by ``notify`` when this process writes events and polls every
+    EVENT_STREAM_POLL_INTERVAL seconds for the ones of other processes, but
+    only while somebody is subscribed.
+    """
+
+    def __init__(self, interval=2.0, batch_size=500):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.last_id = None
+        self.thread = None
+
+    def subscribe(self, account_id):
+        subscription = Subscription(account_id, settings.EVENT_STREAM_QUEUE_SIZE)
+        with self.lock:
+            if not self.subscriptions:
+                ## nobody listened, start from what's in the table now
+                self.last_id = Event.objects.aggregate(last=Max('id'))['last'] or 0
+            subscription.start_id = self.last_id
+            self.subscriptions.add(subscription)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='event-notifier', daemon=True)
+                self.thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def notify(self):
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            with self.lock:
+                if not self.subscriptions:
+                    continue
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('failed to read new events')
+            finally:
+                close_old_connections()
+
+    def poll(self):
+        rows = event_rows(Event.objects.filter(pk__gt=self.last_id).order_by('pk')[:self.batch_size])
+        if not rows:
+            return
+        ## together with subscribe's start_id: a stream gets these rows either
+        ## from its queue or, subscribing later, not at all as they're older
+        with self.lock:
+            self.last_id = rows[-1]['id']
+            subscriptions = list(self.subscriptions)
+
+        parties = {}
+        references = set(row['referenceid'] for row in rows)
+        for internal_id, tenant_id, owner_id in Application.objects.filter(internal_id__in=references) \
+                .values_list('internal_id', 'tenant_id', 'owner_id'):
+            parties.setdefault(internal_id, set()).update([tenant_id, owner_id])
+
+        for row in rows:
+            followers = set([row['who'], row['referenceid']]) | parties.get(row['referenceid'], set())
+            for subscription in subscriptions:
+                if subscription.account_id in followers:
+                    subscription.put(row)
+
+        if len(rows) == self.batch_size:
+            self.wakeup.set()
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = EventNotifier(interval=settings.EVENT_STREAM_POLL_INTERVAL)
+    return _notifier
+
+
+def event_stream(notifier, account_id, last_id, serialize):
+    """
+    Server-Sent Events of the events ``account_id`` follows: the stored ones
+    after ``last_id`` first (all new ones when it's None), then the live ones
+    as they are written. The stream ends after EVENT_STREAM_MAX_DURATION or when
+    the client falls behind, clients reconnect with Last-Event-ID.
+    """
+    subscription = notifier.subscribe(account_id)
+    try:
+        yield 'retry: %d\n\n' % settings.EVENT_STREAM_RETRY_MS
+        if last_id is None:
+            last_id = subscription.start_id
+
+        backlog = account_events(account_id).order_by('pk')
+        while True:
+            rows = event_rows(backlog.filter(pk__gt=last_id)[:notifier.batch_size])
+            for row in rows:
+                last_id = row['id']
+                yield server_sent_event(row, serialize)
+            if len(rows) < notifier.batch_size:
+                break
+
+        deadline = time.monotonic() + settings.EVENT_STREAM_MAX_DURATION
+        while time.monotonic() < deadline:
+            timeout = max(min(settings.EVENT_STREAM_KEEPALIVE, deadline - time.monotonic()), 0)
+            try:
+                row = subscription.get(timeout=timeout)
+            except Empty:
+                yield ': keepalive\n\n'
+                continue
+            if row is None:
+                break
+            if row['id'] > last_id:
+                last_id = row['id']
+                yield server_sent_event(row, serialize)
+    finally:
+        notifier.unsubscribe(subscription)
+
+
+def server_sent_event(row, serialize):
+    return 'id: %s\ndata: %s\n\n' % (row['id'], json.dumps(serialize(row), cls=DjangoJSONEncoder))
@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from api.core.authentication import api_key_cache
+from api.core.queries import time_queries
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf', ), self.counts):
+            total += count
+            yield bound, total
+
+
+class EndpointStats(object):
+
+    def __init__(self):
+        self.responses = Counter()
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.n_plus_one = 0
+        ## (objects, queries) of the smallest page served
+        self.baseline = None
+
+    def grows_with_page(self, objects, queries):
+        """
+        Whether a page of ``objects`` took at least one query per object more
+        than the smallest page, once it's METRICS_N_PLUS_ONE_MIN_GROWTH objects
+        larger so a cache miss or two don't count
+        """
+        if self.baseline is None or (objects, queries) < self.baseline:
+            self.baseline = (objects, queries)
+            return False
+        growth = objects - self.baseline[0]
+        return growth >= settings.METRICS_N_PLUS_ONE_MIN_GROWTH and queries - self.baseline[1] >= growth
+
+
+class RequestTimings(object):
+    """
+    Measurements of one request, the resources add their serialization time
+    """
+
+    def __init__(self):
+        self.serialization_seconds = 0.0
+        self.objects = None
+        self._depth = 0
+
+    @contextmanager
+    def serializing(self):
+        ## nested dehydrates of related resources are part of the outer one
+        self._depth += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if not self._depth:
+                self.serialization_seconds += time.perf_counter() - started
+
+
+class RequestMetrics(object):
+    """
+    Process wide per endpoint (resource, view, method) request metrics
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, status, latency, queries, timings):
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.responses[status] += 1
+            stats.latency.observe(latency)
+            stats.queries.observe(queries.count)
+            stats.sql_seconds += queries.duration
+            stats.serialization_seconds += timings.serialization_seconds
+            flagged = timings.objects is not None and stats.grows_with_page(timings.objects, queries.count)
+            if flagged:
+                stats.n_plus_one += 1
+                baseline = stats.baseline
+        if flagged:
+            logger.warning('%s %s %s: %s queries for %s objects, %s for %s, queries grow with the page size',
+                           endpoint[2], endpoint[0], endpoint[1], queries.count, timings.objects,
+                           baseline[1], baseline[0])
+        return flagged
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def render(self):
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            lines = []
+            metric(lines, 'blockrent_http_responses_total', 'counter', 'Responses by endpoint and status',
+                   [(endpoint_labels(endpoint, status=status), count)
+                    for endpoint, stats in endpoints for status, count in sorted(stats.responses.items())])
+            histogram(lines, 'blockrent_http_request_duration_seconds', 'Total request latency',
+                      [(endpoint, stats.latency) for endpoint, stats in endpoints])
+            histogram(lines, 'blockrent_http_request_queries', 'SQL statements per request',
+                      [(endpoint, stats.queries) for endpoint, stats in endpoints])
+            metric(lines, 'blockrent_http_request_sql_seconds_total', 'counter', 'Time spent in SQL statements',
+                   [(endpoint_labels(endpoint), stats.sql_seconds) for endpoint, stats in endpoints])
+            metric(lines, 'blockrent_http_request_serialization_seconds_total', 'counter',
+                   'Time spent dehydrating and serializing responses, including the SQL run by dehydrate',
+                   [(endpoint_labels(endpoint), stats.serialization_seconds) for endpoint, stats in endpoints])
+            metric(lines, 'blockrent_http_n_plus_one_requests_total', 'counter',
+                   'List requests whose query count grew with the page size',
+                   [(endpoint_labels(endpoint), stats.n_plus_one) for endpoint, stats in endpoints])
+
+        cache = api_key_cache.stats()
+        metric(lines, 'blockrent_api_key_cache_size', 'gauge', 'Authenticated api keys cached in process',
+               [('', cache['size'])])
+        for name in ('hits', 'misses', 'evictions', 'invalidations'):
+            metric(lines, 'blockrent_api_key_cache_%s_total' % name, 'counter', 'Api key cache %s' % name,
+                   [('', cache[name])])
+        return '\n'.join(lines) + '\n'
+
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def endpoint_labels(endpoint, **extra):
+    labels = list(zip(('resource', 'view', 'method'), endpoint)) + sorted(extra.items())
+    return '{%s}' % ','.join('%s="%s"' % (name, label_value(value)) for name, value in labels)
+
+
+def metric(lines, name, kind, help_text, samples):
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s %s' % (name, kind))
+    for labels, value in samples:
+        lines.append('%s%s %s' % (name, labels, value))
+
+
+def histogram(lines, name, help_text, samples):
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s histogram' % name)
+    for endpoint, values in samples:
+        for bound, count in values.cumulative():
+            lines.append('%s_bucket%s %s' % (name, endpoint_labels(endpoint, le=bound), count))
+        lines.append('%s_sum%s %s' % (name, endpoint_labels(endpoint), values.sum))
+        lines.append('%s_count%s %s' % (name, endpoint_labels(endpoint), values.count))
+
+
+request_metrics = RequestMetrics()
+
+
+@contextmanager
+def serialization_timer(request):
+    timings = getattr(request, 'timings', None)
+    if timings is None:
+        yield
+        return
+    with timings.serializing():
+        yield
+
+
+def request_endpoint(request):
+    match = request.resolver_match
+    if match is None:
+        return ('', '', request.method)
+    return (match.kwargs.get('resource_name', ''), match.url_name or '', request.method)
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Records the latency, SQL statements and time and serialization time of
+    every request per resource, view and method for ``/metrics``. Streaming
+    responses are measured up to the start of the stream.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.timings = timings = RequestTimings()
+        started = time.perf_counter()
+        with time_queries() as queries:
+            response = self.get_response(request)
+        request_metrics.record(request_endpoint(request), response.status_code, time.perf_counter() - started,
+                               queries, timings)
+        return response
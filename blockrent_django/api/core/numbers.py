@@ -0,0 +1,53 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+## a number apart from letters, thousands grouped by commas of three digits
+NUMBER = re.compile(r'(?<![\w.,])[-+]?(?:\d{1,3}(?:,\d{3})+|\d+)?(?:\.\d+)?(?![\w.,])')
+
+
+def parse_decimal(value, decimal_places=2, max_digits=None):
+    """
+    Parses the free text amounts and sizes of applications, e.g. '12000',
+    '12,000.50', 'AED 12000' or '80 sqm'. Blank values are None. Values
+    without exactly one number, with letters stuck to it ('12k'), with other
+    separators ('1.200,50') or with more than ``max_digits`` digits raise
+    ValueError.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        number = str(value)
+    else:
+        value = str(value).strip()
+        if not value:
+            return None
+        numbers = [number for number in NUMBER.findall(value) if number.strip('+-')]
+        if len(numbers) != 1 or re.search(r'\d', NUMBER.sub('', value)):
+            raise ValueError('invalid number %r' % value)
+        number = numbers[0].replace(',', '')
+
+    try:
+        number = Decimal(number).quantize(Decimal(1).scaleb(-decimal_places))
+    except InvalidOperation:
+        raise ValueError('invalid number %r' % value)
+    if not number.is_finite() or (max_digits is not None and len(number.as_tuple().digits) > max_digits):
+        raise ValueError('number %r has more than %s digits' % (value, max_digits))
+    return number
+
+
+def parse_decimal_field(field, value):
+    """
+    ``parse_decimal`` with the decimal places and digits of a DecimalField
+    """
+    return parse_decimal(value, field.decimal_places, field.max_digits)
+
+
+def format_decimal(value):
+    """
+    Renders typed amounts the way they used to be stored, '12000' rather than '12000.00'
+    """
+    if value is None:
+        return ''
+    if value == value.to_integral_value():
+        return str(value.quantize(Decimal(1)))
+    return str(value)
@@ -0,0 +1,78 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from api.models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff, EMAIL_OUTBOX_RETRY_DELAY seconds doubled per failed attempt
+    """
+    return timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def pending_emails(batch_size):
+    return list(OutboundEmail.objects.filter(
+        status__in=(OutboundEmail.NEW, OutboundEmail.FAILED),
+        next_attempt_at__lte=timezone.now(),
+    ).order_by('id')[:batch_size])
+
+
+def record_failure(email, error):
+    email.attempts += 1
+    email.last_error = error
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboundEmail.DEAD
+        logger.error('outbox email %s is dead after %s attempts: %s', email.pk, email.attempts, error)
+    else:
+        email.status = OutboundEmail.FAILED
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+        logger.warning('outbox email %s failed (attempt %s): %s', email.pk, email.attempts, error)
+    email.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at'])
+
+
+def drain_outbox(batch_size=None, connection=None):
+    """
+    Delivers one batch of due outbox emails over a single SMTP connection.
+
+    Failed emails are retried with backoff and moved to DEAD after
+    EMAIL_OUTBOX_MAX_ATTEMPTS. Returns ``(sent, failed)`` for the batch.
+    """
+    emails = pending_emails(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    if not emails:
+        return 0, 0
+
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        for email in emails:
+            record_failure(email, 'connection failed: %r' % e)
+        return 0, len(emails)
+
+    sent = failed = 0
+    try:
+        for email in emails:
+            message = EmailMessage(email.subject, email.body, email.from_email or None, email.recipients,
+                                   connection=connection)
+            try:
+                message.send()
+            except Exception as e:
+                record_failure(email, repr(e))
+                failed += 1
+                continue
+            email.status = OutboundEmail.SENT
+            email.sent_at = timezone.now()
+            email.attempts += 1
+            email.save(update_fields=['status', 'sent_at', 'attempts'])
+            sent += 1
+    finally:
+        connection.close()
+
+    return sent, failed
@@ -0,0 +1,75 @@
+from tastypie.exceptions import BadRequest
+from tastypie.paginator import Paginator
+
+
+class KeysetPaginator(Paginator):
+    """
+    Cursor pagination for querysets ordered by ``-id`` (newest first).
+
+    ``?after=<id>`` returns the page of rows older than ``id`` and
+    ``?before=<id>`` the page of rows newer than ``id``. Pages are read with
+    an indexed ``id <`` / ``id >`` range and one extra row to detect if more
+    results follow, no ``COUNT(*)`` or ``OFFSET`` is issued so the cost of a
+    page doesn't depend on the size of the table.
+    """
+
+    def get_cursor(self, name):
+        value = self.request_data.get(name)
+        if value in (None, ''):
+            return None
+
+        try:
+            value = int(value)
+        except ValueError:
+            raise BadRequest("Invalid %s '%s' provided. Please provide an integer." % (name, value))
+
+        return value
+
+    def page(self):
+        limit = self.get_limit()
+        after = self.get_cursor('after')
+        before = self.get_cursor('before')
+
+        if after is not None and before is not None:
+            raise BadRequest("Provide either 'after' or 'before', not both.")
+
+        if before is not None:
+            objects = list(self.objects.filter(pk__gt=before).order_by('pk')[:limit + 1])
+            has_newer = len(objects) > limit
+            objects = objects[:limit]
+            objects.reverse()
+            has_older = bool(objects)
+        else:
+            objects = self.objects
+            if after is not None:
+                objects = objects.filter(pk__lt=after)
+            objects = list(objects.order_by('-pk')[:limit + 1])
+            has_older = len(objects) > limit
+            objects = objects[:limit]
+            has_newer = after is not None and bool(objects)
+
+        meta = {
+            'limit': limit,
+            'previous': self._generate_cursor_uri(limit, 'before', objects[0].pk) if has_newer else None,
+            'next': self._generate_cursor_uri(limit, 'after', objects[-1].pk) if has_older else None,
+        }
+
+        return {
+            self.collection_name: objects,
+            'meta': meta,
+        }
+
+    def _generate_cursor_uri(self, limit, name, value):
+        if self.resource_uri is None:
+            return None
+
+        request_params = self.request_data.copy()
+        for param in ('limit', 'offset', 'after', 'before'):
+            if param in request_params:
+                del request_params[param]
+        request_params.update({'limit': str(limit), name: str(value)})
+
+        return '%s?%s' % (
+            self.resource_uri,
+            request_params.urlencode()
+        )
@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.db.models import Q
+
+from api.models import User
+
+
+class PartyResolver(object):
+    """
+    Request scoped lookup of the parties (tenant/owner) of applications.
+
+    Account ids are collected for a whole page of applications and the users
+    are loaded with a single ``account_id IN (...)`` query, ``get`` then reads
+    from the prefetched rows instead of hitting the database per bundle.
+    """
+
+    def __init__(self):
+        self._users = {}
+
+    @classmethod
+    def for_request(cls, request):
+        if request is None:
+            return cls()
+        resolver = getattr(request, '_party_resolver', None)
+        if resolver is None:
+            resolver = cls()
+            request._party_resolver = resolver
+        return resolver
+
+    def prefetch(self, account_ids):
+        missing = set(account_id for account_id in account_ids if account_id) - set(self._users)
+        if not missing:
+            return
+        for user in User.objects.filter(account_id__in=missing):
+            self._users[user.account_id] = user
+        for account_id in missing:
+            self._users.setdefault(account_id, None)
+
+    def prefetch_applications(self, applications):
+        account_ids = []
+        for application in applications:
+            ## rows already joined through tenant_user/owner_user don't need a lookup
+            if application.tenant_user_id is None:
+                account_ids.append(application.tenant_id)
+            if application.owner_user_id is None:
+                account_ids.append(application.owner_id)
+        self.prefetch(account_ids)
+
+    def get(self, account_id):
+        if account_id not in self._users:
+            self.prefetch([account_id])
+        return self._users.get(account_id)
+
+
+def backfill_application_parties(application_model, user_model, chunk_size=500, after=0):
+    """
+    Copies the legacy tenant_id/owner_id account ids of applications into the
+    tenant_user/owner_user relations, chunk by chunk in primary key order.
+
+    Every chunk is committed on its own and rows that already have both
+    relations are skipped, so an interrupted run can simply be started again
+    (optionally from the last reported id). Yields ``(last_id, updated)`` per chunk.
+    """
+    pending = application_model.objects.filter(Q(tenant_user__isnull=True) | Q(owner_user__isnull=True))
+    while True:
+        with transaction.atomic():
+            rows = list(pending.filter(pk__gt=after).order_by('pk')
+                        .values_list('pk', 'tenant_id', 'owner_id', 'tenant_user_id', 'owner_user_id')[:chunk_size])
+            if not rows:
+                return
+            account_ids = set()
+            for row in rows:
+                account_ids.update(row[1:3])
+            users = dict(user_model.objects.filter(account_id__in=account_ids).values_list('account_id', 'pk'))
+
+            updated = 0
+            for pk, tenant_id, owner_id, tenant_user_id, owner_user_id in rows:
+                changes = {}
+                if tenant_user_id is None and tenant_id in users:
+                    changes['tenant_user_id'] = users[tenant_id]
+                if owner_user_id is None and owner_id in users:
+                    changes['owner_user_id'] = users[owner_id]
+                if changes:
+                    application_model.objects.filter(pk=pk).update(**changes)
+                    updated += 1
+        after = rows[-1][0]
+        yield after, updated
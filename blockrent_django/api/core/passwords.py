@@ -0,0 +1,55 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+def encode_password(password, salt, iterations):
+    return PBKDF2PasswordHasher().encode(password, salt, iterations)
+
+
+def password_iterations(account_type):
+    """
+    PBKDF2 cost of a generated password, Django re-hashes it with the
+    default cost (must_update) the first time the user logs in
+    """
+    return settings.GENERATED_PASSWORD_ITERATIONS.get(account_type, PBKDF2PasswordHasher.iterations)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASHING_WORKERS)
+    return _pool
+
+
+def reset_pool(wait=False):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait)
+        _pool = None
+
+
+def hash_passwords(credentials):
+    """
+    Encodes ``(password, account_type)`` pairs, in the PASSWORD_HASHING_WORKERS
+    process pool so the PBKDF2 rounds run in parallel and off the request's
+    process, inline when the pool is disabled or broken
+    """
+    hasher = PBKDF2PasswordHasher()
+    jobs = [(password, hasher.salt(), password_iterations(account_type)) for password, account_type in credentials]
+    if settings.PASSWORD_HASHING_WORKERS and jobs:
+        try:
+            pool = get_pool()
+            return [future.result() for future in [pool.submit(encode_password, *job) for job in jobs]]
+        except BrokenProcessPool:
+            reset_pool()
+    return [encode_password(*job) for job in jobs]
@@ -0,0 +1,53 @@
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class QueryCount(object):
+    """
+    ``execute_wrapper`` counting the statements run on a connection
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries(using=DEFAULT_DB_ALIAS):
+    counter = QueryCount()
+    with connections[using].execute_wrapper(counter):
+        yield counter
+
+
+class QueryTimer(QueryCount):
+    """
+    ``execute_wrapper`` counting the statements run and the time spent in them
+    """
+
+    def __init__(self):
+        super(QueryTimer, self).__init__()
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return super(QueryTimer, self).__call__(execute, sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+
+
+@contextmanager
+def time_queries():
+    """
+    Counts and times the statements the current thread runs on every database
+    """
+    timer = QueryTimer()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        yield timer
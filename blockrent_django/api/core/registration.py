@@ -0,0 +1,283 @@
+import json
+import uuid
+from random import SystemRandom
+from string import ascii_letters, digits
+
+from django.db import DatabaseError, transaction
+from django.utils.dateparse import parse_date
+from tastypie.models import ApiKey
+
+from api.core.audit import AuditSink
+from api.core.filters import refresh_materialized_filters
+from api.core.helpers import build_account_creation_email, build_application_confirm_emails
+from api.core.numbers import parse_decimal_field
+from api.core.passwords import hash_passwords
+from api.core.search import get_search_backend
+from api.core.summary import record_created
+from api.models import User, Application, OutboundEmail
+
+USERNAME_RANDOM = SystemRandom()
+
+
+class RegistrationFormError(Exception):
+    pass
+
+
+def random_username(length=16, chars=ascii_letters + digits, split=4, delimiter='-'):
+    username = ''.join([USERNAME_RANDOM.choice(chars) for i in range(length)])
+
+    if split:
+        username = delimiter.join([username[start:start + split] for start in range(0, len(username), split)])
+
+    return username
+
+
+def generate_usernames(count):
+    """
+    Returns ``count`` distinct usernames without querying for them: 16 characters
+    from the system CSPRNG are ~95 bits, a clash with an existing user is as
+    unlikely as a uuid4 one and would only fail the unique index (rolling the
+    registration back) rather than create a duplicate
+    """
+    usernames = set()
+    while len(usernames) < count:
+        usernames.add(random_username())
+    return list(usernames)
+
+
+def generate_password(random_uid, first_name, last_name):
+    return random_uid[4:8] + str(first_name)[0] + str(last_name)[0]
+
+
+def parse_party(details):
+    return {
+        'first_name': details['firstName'],
+        'last_name': details['lastName'],
+        'contact_number': details['phoneNumber'],
+        'email': details['email'],
+    }
+
+
+def parse_registration_form(registrationForm):
+    """
+    Maps a ``registrationForm`` payload to the tenant, owner and application fields
+    """
+    try:
+        leaseApplicationDetails = registrationForm['leaseApplicationDetails']
+        depositDetails = registrationForm['depositDetails']
+        form = {
+            'tenant': parse_party(registrationForm['personalDetails']),
+            'owner': parse_party(registrationForm['otherParty']),
+            'application': {
+                'ejari_no': leaseApplicationDetails['contractNo'],
+                'premis_no': leaseApplicationDetails['premiseNo'],
+                'total_contract_value': leaseApplicationDetails['securityDepositAmount'],
+                'address': leaseApplicationDetails['address'],
+                'start_date': leaseApplicationDetails['contractStartDate'],
+                'end_date': leaseApplicationDetails['contractEndDate'],
+                'annual_rent': leaseApplicationDetails['annualRent'],
+                'property_size': leaseApplicationDetails['propertySize'],
+                'property_usage': leaseApplicationDetails['propertyUsage'],
+                'currency_type': leaseApplicationDetails['currencyType'],
+                'deposit_term': depositDetails['term'],
+                'deposit_amount': depositDetails['amount'],
+                'term_percent': depositDetails['termPercent'],
+            }
+        }
+    except (KeyError, TypeError) as e:
+        raise RegistrationFormError('missing field %s' % e)
+
+    ## the passwords are built from the initials
+    for party, details in (('personalDetails', form['tenant']), ('otherParty', form['owner'])):
+        for field, name in (('first_name', 'firstName'), ('last_name', 'lastName')):
+            if not str(details[field]).strip():
+                raise RegistrationFormError('empty %s.%s' % (party, name))
+
+    for field in ('start_date', 'end_date'):
+        try:
+            ## parse_date raises for well formed but impossible dates like 2019-02-30
+            valid = parse_date(str(form['application'][field])) is not None
+        except ValueError:
+            valid = False
+        if not valid:
+            raise RegistrationFormError('invalid date %r for %s' % (form['application'][field], field))
+
+    for field in ('total_contract_value', 'annual_rent', 'property_size', 'deposit_amount', 'term_percent'):
+        try:
+            form['application'][field] = parse_decimal_field(Application._meta.get_field(field),
+                                                             form['application'][field])
+        except ValueError as e:
+            raise RegistrationFormError('%s: %s' % (field, e))
+
+    return form
+
+
+def parse_registration_line(line):
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        raise RegistrationFormError('invalid json: %s' % e)
+    if not isinstance(data, dict):
+        raise RegistrationFormError('expected a json object')
+    return parse_registration_form(data.get('registrationForm', data))
+
+
+class BulkRegistration(object):
+    """
+    Registers a stream of newline delimited ``registrationForm`` payloads.
+
+    Lines are processed in chunks, each chunk in its own transaction: parties
+    are deduplicated by email (within the batch and against existing users),
+    applications by ejari number, and users, api keys, applications, events
+    and outbox emails are written with ``bulk_create``. ``run`` yields one
+    result per non-empty line.
+
+    The passwords of the parties that look new are generated and hashed
+    before the transaction opens, it only holds the write lock for the
+    INSERTs.
+    """
+
+    def __init__(self, chunk_size=200):
+        self.chunk_size = chunk_size
+        self.users = {}
+        self.ejari_nos = set()
+
+    def run(self, lines):
+        ## invalid lines wait for their chunk so the results follow the input order
+        chunk, errors = [], []
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                chunk.append((number, parse_registration_line(line)))
+            except RegistrationFormError as e:
+                errors.append({'line': number, 'status': 'error', 'error': str(e)})
+            if len(chunk) + len(errors) >= self.chunk_size:
+                for result in self.chunk_results(chunk, errors):
+                    yield result
+                chunk, errors = [], []
+        for result in self.chunk_results(chunk, errors):
+            yield result
+
+    def chunk_results(self, chunk, errors):
+        results = self.process_chunk(chunk) if chunk else []
+        return sorted(results + errors, key=lambda result: result['line'])
+
+    def register(self, form):
+        """
+        Registers a single parsed form in its own transaction, database errors
+        propagate and leave nothing behind
+        """
+        chunk = [(None, form)]
+        new_users = self.prepare_users(chunk)
+        with transaction.atomic():
+            result = self._process_chunk(chunk, new_users)[0]
+        del result['line']
+        return result
+
+    def process_chunk(self, chunk):
+        new_users = self.prepare_users(chunk)
+        users, ejari_nos = dict(self.users), set(self.ejari_nos)
+        try:
+            with transaction.atomic():
+                return self._process_chunk(chunk, new_users)
+        except DatabaseError as e:
+            ## the chunk was rolled back, forget what it registered
+            self.users, self.ejari_nos = users, ejari_nos
+            return [{'line': number, 'status': 'error', 'error': 'chunk failed: %s' % e} for number, form in chunk]
+
+    def find_users(self, chunk):
+        emails = set()
+        for number, form in chunk:
+            emails.update([form['tenant']['email'], form['owner']['email']])
+        emails -= set(self.users)
+        if emails:
+            for user in User.objects.filter(email__in=emails):
+                self.users[user.email] = user
+
+    def new_parties(self, chunk):
+        parties = {}
+        for number, form in chunk:
+            for account_type, party in (('TENANT', form['tenant']), ('OWNER', form['owner'])):
+                if party['email'] not in self.users and party['email'] not in parties:
+                    parties[party['email']] = (account_type, party)
+        return parties
+
+    def prepare_users(self, chunk):
+        """
+        Builds the users of the chunk's parties that don't exist yet with
+        hashed generated passwords, outside of any transaction. Returns
+        ``{email: (user, password)}``, a party registered concurrently is
+        found again inside the transaction and its user left unused.
+        """
+        self.find_users(chunk)
+        parties = self.new_parties(chunk)
+        new_users = {}
+        for username, (email, (account_type, party)) in zip(generate_usernames(len(parties)), parties.items()):
+            random_uid = str(uuid.uuid4().hex)
+            user = User(account_id=random_uid, account_type=account_type, username=username, **party)
+            new_users[email] = (user, generate_password(random_uid, party['first_name'], party['last_name']))
+        encoded = hash_passwords([(password, user.account_type) for user, password in new_users.values()])
+        for (user, password), hashed in zip(new_users.values(), encoded):
+            user.password = hashed
+        return new_users
+
+    def _process_chunk(self, chunk, new_users):
+        self.find_users(chunk)
+
+        audit = AuditSink()
+        outbox = self.create_users(chunk, new_users, audit)
+
+        ejari_nos = set(form['application']['ejari_no'] for number, form in chunk)
+        self.ejari_nos.update(
+            Application.objects.filter(ejari_no__in=ejari_nos - self.ejari_nos).values_list('ejari_no', flat=True))
+
+        results = []
+        applications = []
+        for number, form in chunk:
+            tenant = self.users[form['tenant']['email']]
+            owner = self.users[form['owner']['email']]
+            result = {'line': number, 'tenant_id': tenant.account_id, 'owner_id': owner.account_id}
+            ejari_no = form['application']['ejari_no']
+            if ejari_no in self.ejari_nos:
+                result['status'] = 'exists'
+            else:
+                self.ejari_nos.add(ejari_no)
+                application = Application(internal_id=str(uuid.uuid4().hex), tenant_id=tenant.account_id,
+                                          owner_id=owner.account_id, tenant_user=tenant, owner_user=owner,
+                                          **form['application'])
+                applications.append(application)
+                audit.record(referenceid=application.internal_id, what="APPLICATION REGISTRATION",
+                             who=tenant.account_id)
+                outbox.extend(build_application_confirm_emails(tenant, owner, application))
+                result.update({'status': 'created', 'internal_id': application.internal_id})
+            results.append(result)
+
+        Application.objects.bulk_create(applications)
+        record_created(applications)
+
+        ## bulk_create doesn't send post_save, update the derived tables for the chunk here
+        created = list(Application.objects.filter(
+            internal_id__in=[application.internal_id for application in applications]))
+        refresh_materialized_filters([application.pk for application in created])
+        get_search_backend().index(created)
+        audit.flush()
+        OutboundEmail.objects.bulk_create(outbox)
+        return results
+
+    def create_users(self, chunk, new_users, audit):
+        created = [new_users[email] for email in self.new_parties(chunk)]
+        passwords = dict((user.account_id, password) for user, password in created)
+        User.objects.bulk_create([user for user, password in created])
+
+        ## bulk_create doesn't return primary keys on every backend, read them back
+        outbox = []
+        api_keys = []
+        for user in User.objects.filter(account_id__in=passwords):
+            self.users[user.email] = user
+            api_keys.append(ApiKey(user=user, key=ApiKey().generate_key()))
+            audit.record(referenceid=user.account_id, what="%s REGISTRATION" % user.account_type,
+                         who=user.account_id, critical=False)
+            outbox.append(build_account_creation_email(user, passwords[user.account_id]))
+        ApiKey.objects.bulk_create(api_keys)
+        return outbox
@@ -0,0 +1,93 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'replica_pin'
+
+_local = threading.local()
+
+
+class ReplicaRouter(object):
+    """
+    Sends reads to the database chosen by ``replica_reads`` (the replica
+    inside the block, the default database everywhere else), writes always go
+    to the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        return getattr(_local, 'alias', None)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def pin_to_primary(response, user):
+    """
+    Keeps the user's reads on the default database for
+    DATABASE_REPLICA_PIN_SECONDS so they see their own writes. The pin is a
+    signed cookie, it reaches whichever process serves the next request
+    without touching a database.
+    """
+    response.set_signed_cookie(PIN_COOKIE, str(user.pk), salt=PIN_COOKIE,
+                               max_age=settings.DATABASE_REPLICA_PIN_SECONDS, httponly=True)
+
+
+def is_pinned(request, user):
+    ## the signature's timestamp expires the pin whatever the client does with the cookie
+    return request.get_signed_cookie(PIN_COOKIE, default=None, salt=PIN_COOKIE,
+                                     max_age=settings.DATABASE_REPLICA_PIN_SECONDS) == str(user.pk)
+
+
+def read_alias(request):
+    if settings.DATABASE_REPLICA not in settings.DATABASES:
+        return DEFAULT_DB_ALIAS
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and is_pinned(request, user):
+        return DEFAULT_DB_ALIAS
+    return settings.DATABASE_REPLICA
+
+
+@contextmanager
+def replica_reads(request):
+    previous = getattr(_local, 'alias', None)
+    _local.alias = read_alias(request)
+    try:
+        yield _local.alias
+    finally:
+        _local.alias = previous
+
+
+def read_from_replica(view):
+    """
+    Runs a resource view (``get_list``/``get_detail``) with its reads routed
+    to the replica, call it after authentication so request.user is known
+    """
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        with replica_reads(request):
+            return view(self, request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaPinMiddleware(object):
+    """
+    Pins the authenticated user of every unsafe request to the default
+    database, tastypie sets request.user while handling the request
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if request.method not in SAFE_METHODS and user is not None and user.is_authenticated:
+            pin_to_primary(response, user)
+        return response
@@ -0,0 +1,164 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from api.core.changes import saved_changes
+from api.models import User, Application
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+## the backend of the default database's vendor when APPLICATION_SEARCH_BACKEND isn't set
+VENDOR_BACKENDS = {
+    'sqlite': 'api.core.search.SQLiteFTSBackend',
+}
+DEFAULT_BACKEND = 'api.core.search.DatabaseSearchBackend'
+
+## what an application's index row is made of
+INDEXED_COLUMNS = ('ejari_no', 'premis_no', 'address', 'tenant_id', 'owner_id')
+NAME_COLUMNS = ('first_name', 'last_name')
+
+
+class SearchBackend(object):
+    """
+    Search index over application addresses, ejari/premise numbers and the
+    full names of the tenant and owner. ``search`` returns application ids
+    best match first.
+    """
+
+    def index(self, applications):
+        raise NotImplementedError()
+
+    def remove(self, application_ids):
+        raise NotImplementedError()
+
+    def rebuild(self):
+        raise NotImplementedError()
+
+    def search(self, query, limit, offset=0):
+        raise NotImplementedError()
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """
+    Portable fallback without an index, every word has to appear in one of
+    the searched columns. Newest applications first.
+    """
+
+    def index(self, applications):
+        pass
+
+    def remove(self, application_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, limit, offset=0):
+        condition = Q()
+        for word in WORD.findall(query):
+            users = User.objects.filter(Q(first_name__icontains=word) | Q(last_name__icontains=word)) \
+                .values('account_id')
+            condition &= Q(address__icontains=word) | Q(ejari_no__icontains=word) | Q(premis_no__icontains=word) \
+                | Q(tenant_id__in=users) | Q(owner_id__in=users)
+        if not condition:
+            return []
+        return list(Application.objects.filter(condition).order_by('-id')
+                    .values_list('id', flat=True)[offset:offset + limit])
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    SQLite FTS5 index, the virtual table is keyed by the application id and
+    results are ranked with bm25. Every query word is matched as a prefix.
+    """
+    table = 'api_application_search'
+    columns = ('ejari_no', 'premis_no', 'address', 'tenant_name', 'owner_name')
+
+    def index(self, applications):
+        applications = [application for application in applications if application.pk is not None]
+        if not applications:
+            return
+        account_ids = set()
+        for application in applications:
+            account_ids.update([application.tenant_id, application.owner_id])
+        names = dict((user.account_id, user.full_name) for user in
+                     User.objects.filter(account_id__in=account_ids).only('account_id', 'first_name', 'last_name'))
+
+        rows = [(application.pk, application.ejari_no, application.premis_no, application.address,
+                 names.get(application.tenant_id, ''), names.get(application.owner_id, ''))
+                for application in applications]
+        self.remove([row[0] for row in rows])
+        with connection.cursor() as cursor:
+            cursor.executemany('INSERT INTO %s (rowid, %s) VALUES (%%s, %%s, %%s, %%s, %%s, %%s)' % (
+                self.table, ', '.join(self.columns)), rows)
+
+    def remove(self, application_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % self.table,
+                               [(application_id, ) for application_id in application_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            rebuild_sqlite_index(cursor, self.table)
+
+    def search(self, query, limit, offset=0):
+        words = WORD.findall(query)
+        if not words:
+            return []
+        match = ' '.join('"%s"*' % word for word in words)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM %s WHERE %s MATCH %%s ORDER BY rank LIMIT %%s OFFSET %%s' % (
+                self.table, self.table), [match, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+def create_sqlite_index(cursor, table):
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+                   "ejari_no, premis_no, address, tenant_name, owner_name, prefix='2 3')" % table)
+
+
+def rebuild_sqlite_index(cursor, table):
+    cursor.execute('DELETE FROM %s' % table)
+    cursor.execute(
+        "INSERT INTO %s (rowid, ejari_no, premis_no, address, tenant_name, owner_name) "
+        "SELECT a.id, a.ejari_no, a.premis_no, a.address, "
+        "COALESCE(t.first_name || ' ' || t.last_name, ''), COALESCE(o.first_name || ' ' || o.last_name, '') "
+        "FROM api_application a "
+        "LEFT JOIN auth_user t ON t.account_id = a.tenant_id "
+        "LEFT JOIN auth_user o ON o.account_id = a.owner_id" % table)
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.APPLICATION_SEARCH_BACKEND or
+                                 VENDOR_BACKENDS.get(connection.vendor, DEFAULT_BACKEND))()
+    return _backend
+
+
+@receiver(post_save, sender=Application)
+def application_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if not raw and saved_changes(instance, INDEXED_COLUMNS, '_search_values', created, update_fields):
+        get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=Application)
+def application_deleted(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    ## the party names are denormalized into the index
+    if raw or created or not saved_changes(instance, NAME_COLUMNS, '_search_names', created, update_fields):
+        return
+    get_search_backend().index(
+        Application.objects.filter(Q(tenant_id=instance.account_id) | Q(owner_id=instance.account_id)))
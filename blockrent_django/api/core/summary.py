@@ -0,0 +1,134 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from api.models import Application, UserApplicationSummary
+
+PENDING_CONFIRMATION = UserApplicationSummary.PENDING_CONFIRMATION
+SUMMARY_FIELDS = ('tenant_id', 'owner_id', 'status', 'is_confirmed_by_tenant', 'is_confirmed_by_owner')
+
+
+def contributions(values):
+    """
+    The (account_id, status) counters an application with ``values`` adds to,
+    once for the tenant and once for the owner
+    """
+    counts = Counter()
+    if not values:
+        return counts
+    for account_field, confirmed_field in (('tenant_id', 'is_confirmed_by_tenant'),
+                                           ('owner_id', 'is_confirmed_by_owner')):
+        account_id = values[account_field]
+        counts[(account_id, values['status'])] += 1
+        if values['status'] == 'NEW' and values[confirmed_field] != 'YES':
+            counts[(account_id, PENDING_CONFIRMATION)] += 1
+    return counts
+
+
+def summary_values(application):
+    return dict((field, getattr(application, field)) for field in SUMMARY_FIELDS)
+
+
+def apply_delta(delta):
+    """
+    Adds ``delta`` ({(account_id, status): n}) to the summary, call it in the
+    transaction that changed the applications. The existing counters are read
+    with one query, the missing ones inserted with one and the others changed
+    with a single UPDATE, however many accounts the delta touches.
+    """
+    delta = dict((key, count) for key, count in delta.items() if count)
+    if not delta:
+        return
+    with transaction.atomic():
+        existing = dict(((account_id, status), pk) for pk, account_id, status in UserApplicationSummary.objects.filter(
+            account_id__in=set(account_id for account_id, status in delta),
+            status__in=set(status for account_id, status in delta)).values_list('pk', 'account_id', 'status')
+            if (account_id, status) in delta)
+        UserApplicationSummary.objects.bulk_create([
+            UserApplicationSummary(account_id=account_id, status=status, count=count)
+            for (account_id, status), count in sorted(delta.items()) if (account_id, status) not in existing])
+        if existing:
+            UserApplicationSummary.objects.filter(pk__in=existing.values()).update(count=F('count') + Case(
+                *[When(pk=pk, then=Value(delta[key])) for key, pk in sorted(existing.items())],
+                default=Value(0), output_field=IntegerField()))
+
+
+def record_change(old_values, new_values):
+    delta = contributions(new_values)
+    delta.subtract(contributions(old_values))
+    apply_delta(delta)
+
+
+def record_created(applications):
+    """
+    Counts applications written without signals, e.g. with bulk_create
+    """
+    delta = Counter()
+    for application in applications:
+        delta.update(contributions(summary_values(application)))
+    apply_delta(delta)
+
+
+def rebuild_summary(application_model, summary_model):
+    """
+    Recomputes the whole summary with GROUP BY queries
+    """
+    counts = Counter()
+    for account_field, confirmed_field in (('tenant_id', 'is_confirmed_by_tenant'),
+                                           ('owner_id', 'is_confirmed_by_owner')):
+        for row in application_model.objects.values(account_field, 'status').annotate(n=Count('id')).order_by():
+            counts[(row[account_field], row['status'])] += row['n']
+        pending = application_model.objects.filter(status='NEW').exclude(**{confirmed_field: 'YES'})
+        for row in pending.values(account_field).annotate(n=Count('id')).order_by():
+            counts[(row[account_field], PENDING_CONFIRMATION)] += row['n']
+
+    with transaction.atomic():
+        summary_model.objects.all().delete()
+        summary_model.objects.bulk_create(
+            [summary_model(account_id=account_id, status=status, count=count)
+             for (account_id, status), count in counts.items() if count])
+    return len(counts)
+
+
+def get_summary(account_id):
+    counts = dict((status, 0) for status, label in Application.APPLICATION_STATUS_CHOICES)
+    pending = 0
+    for status, count in UserApplicationSummary.objects.filter(account_id=account_id).values_list('status', 'count'):
+        if status == PENDING_CONFIRMATION:
+            pending = count
+        else:
+            counts[status] = count
+    return {
+        'account_id': account_id,
+        'counts': counts,
+        'pending_confirmations': pending,
+    }
+
+
+@receiver(pre_save, sender=Application)
+def application_pre_save(sender, instance, raw=False, **kwargs):
+    ## instances that weren't loaded from the database need their stored values read once
+    if raw or instance.pk is None:
+        return
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is not None and all(field in loaded for field in SUMMARY_FIELDS):
+        return
+    instance._loaded_values = Application.objects.filter(pk=instance.pk).values(*SUMMARY_FIELDS).first()
+
+
+@receiver(post_save, sender=Application)
+def application_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_values = None if created else getattr(instance, '_loaded_values', None)
+    new_values = summary_values(instance)
+    record_change(old_values, new_values)
+    instance._loaded_values = new_values
+
+
+@receiver(post_delete, sender=Application)
+def application_post_delete(sender, instance, **kwargs):
+    record_change(getattr(instance, '_loaded_values', None) or summary_values(instance), None)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.core.archive import archive_events
+
+
+class Command(BaseCommand):
+    help = 'Moves old and handled/ignored events from the Event table into the ArchivedEvent table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = 0
+        for last_id, archived in archive_events(chunk_size=options['chunk_size']):
+            total += archived
+            self.stdout.write('archived %s events up to id %s' % (archived, last_id))
+        self.stdout.write(self.style.SUCCESS('done, %s events archived' % total))
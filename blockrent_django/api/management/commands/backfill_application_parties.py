@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.core.parties import backfill_application_parties
+from api.models import Application, User
+
+
+class Command(BaseCommand):
+    help = 'Backfills Application.tenant_user/owner_user from the legacy tenant_id/owner_id columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--after', type=int, default=0,
+                            help='resume after this application id')
+
+    def handle(self, *args, **options):
+        total = 0
+        for last_id, updated in backfill_application_parties(Application, User, chunk_size=options['chunk_size'],
+                                                             after=options['after']):
+            total += updated
+            self.stdout.write('backfilled %s applications up to id %s' % (updated, last_id))
+        self.stdout.write(self.style.SUCCESS('done, %s applications backfilled' % total))
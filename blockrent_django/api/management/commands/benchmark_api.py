@@ -0,0 +1,307 @@
+import datetime
+import json
+import math
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.core.authentication import api_key_cache
+from api.core.queries import time_queries
+from api.core.search import get_search_backend
+from api.core.summary import rebuild_summary
+from api.management.commands.benchmark_registration import registration_form
+from api.models import User, Application, Event, AppFilter, UserApplicationSummary
+
+DEFAULT_VOLUMES = {'users': 1000, 'applications': 10000, 'events': 50000, 'filters': 100}
+## extra requests per scenario measured for peak memory
+MEMORY_REQUESTS = 3
+BULK_CONFIRM_IDS = 50
+PASSWORD = 'benchmark-password'
+FILTER_SET = {'property_type': '', 'property_size': {'name': '', 'value': 0, 'from': 0, 'to': 0},
+              'tenant_name': '', 'owner_name': '', 'start_date': '', 'end_date': '', 'address': ''}
+
+
+def get(path):
+    return lambda seed, i: ('get', path.format(**seed), None, None)
+
+
+def post(path, body, content_type='application/json'):
+    return lambda seed, i: ('post', path.format(**seed), body(seed, i), content_type)
+
+
+## (resource, scenario, request builder), every resource registered on v1_api needs one.
+## events/stream/ is a long lived response and isn't benchmarked. Write scenarios
+## never repeat a write: the confirmations use their own pools of applications,
+## request i confirming ids nobody confirmed before.
+SCENARIOS = (
+    ('users', 'users list', get('/api/v1/users/?limit=20')),
+    ('users', 'users detail', get('/api/v1/users/{user_pk}/')),
+    ('users', 'users summary', get('/api/v1/users/{user_pk}/summary/')),
+    ('users', 'users login', post('/api/v1/users/login/',
+                                  lambda seed, i: json.dumps({'email': seed['username'], 'password': PASSWORD}))),
+    ('applications', 'applications list', get('/api/v1/applications/?limit=20')),
+    ('applications', 'applications list, 100 rows', get('/api/v1/applications/?limit=100')),
+    ('applications', 'applications list, sparse fields',
+     get('/api/v1/applications/?limit=100&fields=ejari_no,status,tenant_name,owner_name')),
+    ('applications', 'applications list by tenant', get('/api/v1/applications/?tenant_id={account_id}')),
+    ('applications', 'applications detail', get('/api/v1/applications/{application_pk}/')),
+    ('applications', 'applications search', get('/api/v1/applications/search/?q=Benchmark')),
+    ('applications', 'applications export', get('/api/v1/applications/export/?tenant_id={account_id}')),
+    ('application-detail', 'application-detail detail', get('/api/v1/application-detail/{application_pk}/')),
+    ('events', 'events list', get('/api/v1/events/?limit=20')),
+    ('events', 'events list, older page', get('/api/v1/events/?limit=20&after={event_pk}')),
+    ('events', 'events detail', get('/api/v1/events/{event_pk}/')),
+    ('events', 'events history', get('/api/v1/events/history/{internal_id}/')),
+    ('events', 'events export', get('/api/v1/events/export/?format=ndjson&who__iexact={other_account_id}')),
+    ('registerApplication', 'registerApplication', post(
+        '/api/v1/registerApplication/', lambda seed, i: json.dumps(registration_form('api', i)))),
+    ('registerApplication', 'registerApplication bulk, 10 forms', post(
+        '/api/v1/registerApplication/bulk/',
+        lambda seed, i: '\n'.join(json.dumps(registration_form('bulk-%s' % i, j)) for j in range(10)),
+        'application/x-ndjson')),
+    ('confirmApplication', 'confirmApplication', post(
+        '/api/v1/confirmApplication/', lambda seed, i: json.dumps({
+            'applicationID': seed['confirm_ids'][i], 'userID': seed['confirm_account_id']}))),
+    ('confirmApplication', 'confirmApplication bulk, %s ids' % BULK_CONFIRM_IDS, post(
+        '/api/v1/confirmApplication/bulk/', lambda seed, i: json.dumps({
+            'applicationIDs': seed['bulk_confirm_ids'][i * BULK_CONFIRM_IDS:(i + 1) * BULK_CONFIRM_IDS],
+            'userID': seed['confirm_account_id']}))),
+    ('filters', 'filters list', get('/api/v1/filters/')),
+    ('filters', 'filters detail', get('/api/v1/filters/{filter_pk}/')),
+    ('filters', 'filters results', get('/api/v1/filters/{filter_pk}/results/')),
+    ('filters', 'filters create', post('/api/v1/filters/', lambda seed, i: json.dumps(
+        {'filter_name': 'benchmark %s' % i, 'filter_set': FILTER_SET}))),
+)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+def seed_database(volumes, requests):
+    """
+    Writes the volumes with bulk_create and rebuilds the derived tables once,
+    returns the ids the scenarios use. The benchmark user (an admin) is the
+    tenant of every tenth application and owns every saved filter.
+
+    On top of the volumes a separate tenant gets NEW applications for the
+    confirmation scenarios, one per request and BULK_CONFIRM_IDS per bulk
+    request, so every request of ``requests`` confirms fresh ones.
+    """
+    rng = random.Random(0)
+    user = User.objects.create(username='benchmark', email='benchmark@example.com', account_id='benchmark',
+                               first_name='Bench', last_name='Mark', account_type='TENANT', is_admin=True,
+                               password=make_password(PASSWORD))
+    password = make_password(None)
+    User.objects.bulk_create([User(
+        username='user%s' % i, email='user%s@example.com' % i, account_id='acc%s' % i, first_name='First%s' % i,
+        last_name='Last%s' % i, contact_number='0500000000', account_type=('TENANT', 'OWNER')[i % 2],
+        password=password) for i in range(volumes['users'])])
+    users = list(User.objects.exclude(pk=user.pk).values_list('account_id', 'pk'))
+
+    start = datetime.date(2019, 1, 1)
+    applications = []
+    for i in range(volumes['applications']):
+        tenant = (user.account_id, user.pk) if i % 10 == 0 else users[rng.randrange(len(users))]
+        owner = users[rng.randrange(len(users))]
+        rent = Decimal(rng.randrange(20000, 300000))
+        applications.append(Application(
+            ejari_no='EJ%07d' % i, premis_no=str(i), internal_id='app%07d' % i, address='%s Benchmark Street' % i,
+            tenant_id=tenant[0], tenant_user_id=tenant[1], owner_id=owner[0], owner_user_id=owner[1],
+            status=rng.choice(('NEW', 'NEW', 'CONFIRMED', 'ACTIVE')), annual_rent=rent, total_contract_value=rent,
+            property_size=Decimal(rng.randrange(40, 400)), deposit_amount=rent / 20, currency_type='AED',
+            start_date=start, end_date=start + datetime.timedelta(days=365)))
+    Application.objects.bulk_create(applications)
+
+    confirming = User.objects.create(username='benchmark-confirm', email='benchmark-confirm@example.com',
+                                     account_id='benchmark-confirm', first_name='Con', last_name='Firm',
+                                     account_type='TENANT', password=password)
+    pools = {}
+    for pool, per_request in (('confirm', 1), ('bulkconfirm', BULK_CONFIRM_IDS)):
+        pools[pool] = ['%s%07d' % (pool, i) for i in range((requests + MEMORY_REQUESTS) * per_request)]
+        Application.objects.bulk_create([Application(
+            ejari_no=internal_id, premis_no=internal_id, internal_id=internal_id, address='Confirmation Street',
+            tenant_id=confirming.account_id, tenant_user_id=confirming.pk, owner_id=users[0][0],
+            owner_user_id=users[0][1], status='NEW', start_date=start, end_date=start + datetime.timedelta(days=365))
+            for internal_id in pools[pool]])
+
+    Event.objects.bulk_create([Event(
+        referenceid=applications[rng.randrange(len(applications))].internal_id if applications else '',
+        what=rng.choice(('APPLICATION REGISTRATION', 'APPLICATION CONFIRMATION', 'EMAIL SENT')),
+        who=users[rng.randrange(len(users))][0], status=rng.choice(('NEW', 'HANDLED')))
+        for i in range(volumes['events'])])
+
+    AppFilter.objects.bulk_create([AppFilter(
+        filter_owner=user, filter_name='filter %s' % i, property_type='Residential' if i % 2 else '',
+        address='%s Benchmark' % i if i % 3 == 0 else '') for i in range(volumes['filters'])])
+
+    rebuild_summary(Application, UserApplicationSummary)
+    get_search_backend().rebuild()
+
+    internal_id = Application.objects.filter(tenant_id=user.account_id).order_by('pk') \
+        .values_list('internal_id', flat=True)[0]
+    events = list(Event.objects.order_by('-pk').values_list('pk', flat=True)[:100])
+    return {
+        'user_pk': user.pk,
+        'username': user.username,
+        'account_id': user.account_id,
+        'other_account_id': users[0][0],
+        'api_key': user.api_key.key,
+        'application_pk': Application.objects.filter(tenant_id=user.account_id).values_list('pk', flat=True)[0],
+        'internal_id': internal_id,
+        'confirm_account_id': confirming.account_id,
+        'confirm_ids': pools['confirm'],
+        'bulk_confirm_ids': pools['bulkconfirm'],
+        'event_pk': events[-1],
+        'filter_pk': AppFilter.objects.filter(filter_owner=user).order_by('pk').values_list('pk', flat=True)[0],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Seeds a scratch test database and measures latency percentiles, queries per request and peak ' \
+           'memory of every v1_api resource, failing on regressions against the stored thresholds'
+
+    def add_arguments(self, parser):
+        for name in sorted(DEFAULT_VOLUMES):
+            parser.add_argument('--%s' % name, type=int, help='rows to seed, defaults to the thresholds volumes')
+        parser.add_argument('--requests', type=int, default=50, help='requests per scenario')
+        parser.add_argument('--scenario', action='append', help='only run scenarios containing this text')
+        parser.add_argument('--thresholds', default=settings.BENCHMARK_THRESHOLDS)
+        parser.add_argument('--update-thresholds', action='store_true',
+                            help='write the thresholds from this run, with headroom for slower machines')
+
+    def handle(self, *args, **options):
+        from blockrent_django.urls import v1_api
+
+        missing = set(v1_api._registry) - set(resource for resource, label, build in SCENARIOS)
+        if missing:
+            raise CommandError('no benchmark scenario for the resources %s' % ', '.join(sorted(missing)))
+
+        stored = {}
+        if os.path.exists(options['thresholds']):
+            with open(options['thresholds']) as f:
+                stored = json.load(f)
+        volumes = dict(DEFAULT_VOLUMES, **stored.get('volumes', {}))
+        volumes.update((name, options[name]) for name in DEFAULT_VOLUMES if options[name] is not None)
+
+        scenarios = [(resource, label, build) for resource, label, build in SCENARIOS
+                     if not options['scenario'] or any(text in label for text in options['scenario'])]
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            ## reads have to see the seeded test database, not a replica of the real one
+            with override_settings(DATABASE_REPLICA=None, DEBUG=False):
+                started = time.monotonic()
+                seed = seed_database(volumes, options['requests'])
+                self.stdout.write('seeded %s in %.1fs' % (
+                    ', '.join('%s %s' % (volumes[name], name) for name in sorted(volumes)), time.monotonic() - started))
+                results = [(label, self.run_scenario(build, seed, options['requests'])) for resource, label, build
+                           in scenarios]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            api_key_cache.clear()
+
+        self.report(results)
+        if options['update_thresholds']:
+            self.write_thresholds(options['thresholds'], volumes, options['requests'], results)
+            return
+        ## the write scenarios change the data the later ones read, only a run
+        ## like the stored one is comparable
+        differences = [name for name, differs in (
+            ('seeded volumes', stored.get('volumes') != volumes),
+            ('requests per scenario', stored.get('requests') != options['requests']),
+            ('scenarios', set(stored.get('scenarios', {})) != set(label for label, result in results))) if differs]
+        if differences:
+            self.stdout.write(self.style.WARNING('%s differ from the thresholds file, not checked' %
+                                                 ', '.join(differences)))
+        else:
+            self.check_thresholds(stored['scenarios'], results)
+
+    def run_scenario(self, build, seed, requests):
+        client = Client(HTTP_AUTHORIZATION='ApiKey %s:%s' % (seed['username'], seed['api_key']))
+        latencies, queries, statuses = [], [], set()
+        for i in range(requests):
+            latency, count, status = self.request(client, build(seed, i))
+            latencies.append(latency)
+            queries.append(count)
+            statuses.add(status)
+
+        ## measured apart, tracing allocations slows the requests down
+        tracemalloc.start()
+        try:
+            for i in range(requests, requests + MEMORY_REQUESTS):
+                self.request(client, build(seed, i))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'queries_median': statistics.median(queries),
+            'queries': max(queries),
+            'peak_kb': peak / 1024.0,
+            'errors': sorted(status for status in statuses if status >= 400),
+        }
+
+    def request(self, client, request):
+        method, path, body, content_type = request
+        started = time.perf_counter()
+        with time_queries() as queries:
+            if method == 'get':
+                response = client.get(path)
+            else:
+                response = client.post(path, body, content_type=content_type)
+            if response.streaming:
+                for chunk in response.streaming_content:
+                    pass
+        return time.perf_counter() - started, queries.count, response.status_code
+
+    def report(self, results):
+        self.stdout.write('%-40s %9s %9s %9s %9s %9s %10s' % (
+            'scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'max q', 'peak KB'))
+        for label, result in results:
+            self.stdout.write('%-40s %9.1f %9.1f %9.1f %9g %9d %10.0f%s' % (
+                label, result['p50_ms'], result['p95_ms'], result['p99_ms'], result['queries_median'],
+                result['queries'], result['peak_kb'],
+                '  HTTP %s' % ', '.join(map(str, result['errors'])) if result['errors'] else ''))
+
+    def check_thresholds(self, thresholds, results):
+        failures = []
+        for label, result in results:
+            if result['errors']:
+                failures.append('%s: HTTP %s' % (label, ', '.join(map(str, result['errors']))))
+            for name, limit in sorted(thresholds.get(label, {}).items()):
+                if result[name] > limit:
+                    failures.append('%s: %s %.1f over %s' % (label, name, result[name], limit))
+        if failures:
+            raise CommandError('benchmark regressions:\n  %s' % '\n  '.join(failures))
+        self.stdout.write(self.style.SUCCESS('all scenarios within their thresholds'))
+
+    def write_thresholds(self, path, volumes, requests, results):
+        scenarios = {}
+        for label, result in results:
+            scenarios[label] = {
+                'p95_ms': math.ceil(max(result['p95_ms'] * 3, 10)),
+                'queries': result['queries'],
+                'peak_kb': math.ceil(max(result['peak_kb'] * 1.5, 256)),
+            }
+        with open(path, 'w') as f:
+            json.dump({'volumes': volumes, 'requests': requests, 'scenarios': scenarios}, f, indent=2,
+                      sort_keys=True)
+            f.write('\n')
+        self.stdout.write(self.style.SUCCESS('wrote %s' % path))
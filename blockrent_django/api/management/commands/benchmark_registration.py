@@ -0,0 +1,99 @@
+import json
+import resource
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api.core.passwords import reset_pool
+
+MODES = (
+    ('inline, default cost', {'PASSWORD_HASHING_WORKERS': 0, 'GENERATED_PASSWORD_ITERATIONS': {}}),
+    ('pool, default cost', {'GENERATED_PASSWORD_ITERATIONS': {}}),
+    ('pool, per account type cost', {}),
+)
+
+
+def registration_form(run, i):
+    party = lambda role: {'firstName': role.title(), 'lastName': str(i), 'phoneNumber': '0500000000',
+                          'email': '%s-%s-%s@benchmark.example.com' % (role, run, i)}
+    return {'registrationForm': {
+        'personalDetails': party('tenant'),
+        'otherParty': party('owner'),
+        'leaseApplicationDetails': {
+            'contractNo': 'BENCH-%s-%s' % (run, i), 'premiseNo': str(i), 'securityDepositAmount': '5000',
+            'address': '%s Benchmark Street' % i, 'contractStartDate': '2019-01-01',
+            'contractEndDate': '2020-01-01', 'annualRent': '60000', 'propertySize': '80',
+            'propertyUsage': 'Residential', 'currencyType': 'AED',
+        },
+        'depositDetails': {'term': 'Fixed Amount', 'amount': '5000', 'termPercent': '5'},
+    }}
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Command(BaseCommand):
+    help = 'Measures registrations per second and CPU per registration (including the password hashing ' \
+           'workers) of the registration endpoint with inline and pooled password hashing, on a scratch test ' \
+           'database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--registrations', type=int, default=40)
+        parser.add_argument('--threads', type=int, default=4)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for run, (label, overrides) in enumerate(MODES):
+                with override_settings(**overrides):
+                    elapsed, cpu, workers_cpu = self.run_registrations(run, options)
+                per_registration = 1000.0 / options['registrations']
+                self.stdout.write('%s: %.1f registrations/s, %.1fms CPU per registration, %.1fms of it in the '
+                                  'hashing workers' % (label, options['registrations'] / elapsed,
+                                                       (cpu + workers_cpu) * per_registration,
+                                                       workers_cpu * per_registration))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run_registrations(self, run, options):
+        numbers = iter(range(options['registrations']))
+        lock = threading.Lock()
+        failures = []
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    with lock:
+                        i = next(numbers, None)
+                    if i is None:
+                        return
+                    response = client.post('/api/v1/registerApplication/', json.dumps(registration_form(run, i)),
+                                           content_type='application/json')
+                    if response.status_code != 201:
+                        failures.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        ## the pool's workers are only counted in RUSAGE_CHILDREN once they
+        ## exited, every mode starts a fresh pool and joins it at the end
+        reset_pool(wait=True)
+        started, cpu_started, children_started = time.monotonic(), time.process_time(), children_cpu()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed, cpu = time.monotonic() - started, time.process_time() - cpu_started
+        reset_pool(wait=True)
+        if failures:
+            self.stderr.write('%s registrations failed: %s' % (len(failures), sorted(set(failures))))
+        return elapsed, cpu, children_cpu() - children_started
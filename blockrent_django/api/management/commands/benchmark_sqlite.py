@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction, OperationalError
+from django.db.models import F
+
+from api.models import User, Application, Event, UserApplicationSummary
+
+ENGINES = (
+    ('stock', 'django.db.backends.sqlite3'),
+    ('tuned', 'api.backends.sqlite3'),
+)
+
+
+def register(alias, worker, i):
+    """
+    The writes of a registration: an application, its audit events and the
+    read-modify-write of a dashboard counter, in one transaction
+    """
+    account_id = 'bench%s' % worker
+    with transaction.atomic(using=alias):
+        UserApplicationSummary.objects.using(alias).filter(account_id=account_id, status='NEW').exists()
+        Application.objects.using(alias).bulk_create([Application(
+            internal_id=uuid.uuid4().hex, ejari_no='B%s-%s' % (worker, i), tenant_id=account_id,
+            owner_id='owner', start_date='2019-01-01', end_date='2020-01-01')])
+        Event.objects.using(alias).bulk_create(
+            [Event(referenceid='B%s-%s' % (worker, i), what=what, who=account_id) for what in ('CREATED', 'EMAILED')])
+        UserApplicationSummary.objects.using(alias).filter(account_id=account_id, status='NEW') \
+            .update(count=F('count') + 1)
+
+
+def browse(alias):
+    list(Application.objects.using(alias).order_by('-id').values_list('id', 'ejari_no')[:20])
+
+
+class Command(BaseCommand):
+    help = 'Measures concurrent registration throughput on the stock and the tuned SQLite engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--transactions', type=int, default=100,
+                            help='registrations per writer thread')
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='blockrent-bench-')
+        try:
+            for label, engine in ENGINES:
+                alias = 'benchmark_%s' % label
+                connections.databases[alias] = {'ENGINE': engine, 'NAME': os.path.join(directory, label + '.sqlite3')}
+                with connections[alias].schema_editor() as editor:
+                    for model in (User, Application, Event, UserApplicationSummary):
+                        editor.create_model(model)
+                for worker in range(options['writers']):
+                    UserApplicationSummary.objects.using(alias).create(
+                        account_id='bench%s' % worker, status='NEW', count=0)
+                connections[alias].close()
+
+                committed, failed, elapsed = self.run_workload(alias, options)
+                self.stdout.write('%s: %s committed, %s failed in %.2fs, %.1f registrations/s' % (
+                    label, committed, failed, elapsed, committed / elapsed))
+        finally:
+            shutil.rmtree(directory)
+
+    def run_workload(self, alias, options):
+        results = {'committed': 0, 'failed': 0}
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def writer(worker):
+            try:
+                for i in range(options['transactions']):
+                    try:
+                        register(alias, worker, i)
+                        outcome = 'committed'
+                    except OperationalError:
+                        outcome = 'failed'
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                connections[alias].close()
+
+        def reader():
+            try:
+                while not done.is_set():
+                    try:
+                        browse(alias)
+                    except OperationalError:
+                        pass
+            finally:
+                connections[alias].close()
+
+        writers = [threading.Thread(target=writer, args=(worker, )) for worker in range(options['writers'])]
+        readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        started = time.monotonic()
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.monotonic() - started
+        done.set()
+        for thread in readers:
+            thread.join()
+        return results['committed'], results['failed'], elapsed
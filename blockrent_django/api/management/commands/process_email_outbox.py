@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.core.outbox import drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued transactional emails from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true',
+                            help='keep draining the outbox instead of exiting once it is empty')
+        parser.add_argument('--sleep', type=float, default=5,
+                            help='seconds to wait between polls when the outbox is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = drain_outbox(batch_size=options['batch_size'])
+            if sent or failed:
+                self.stdout.write('sent %s, failed %s' % (sent, failed))
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['sleep'])
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api.core.summary import rebuild_summary
+from api.models import Application, UserApplicationSummary
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per account application counters from the Application table'
+
+    def handle(self, *args, **options):
+        rows = rebuild_summary(Application, UserApplicationSummary)
+        self.stdout.write(self.style.SUCCESS('rebuilt %s summary rows' % rows))
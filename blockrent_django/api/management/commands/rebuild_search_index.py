@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.core.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the application search index'
+
+    def handle(self, *args, **options):
+        get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS('search index rebuilt'))
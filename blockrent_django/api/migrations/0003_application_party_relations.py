@@ -0,0 +1,25 @@
+# Generated by Django 2.1.15 on 2026-10-18 14:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_application_currency_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='owner_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='owner_applications', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='tenant_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tenant_applications', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
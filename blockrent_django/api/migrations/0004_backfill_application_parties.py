@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from api.core.parties import backfill_application_parties
+
+
+def forwards(apps, schema_editor):
+    Application = apps.get_model('api', 'Application')
+    User = apps.get_model('api', 'User')
+    for _ in backfill_application_parties(Application, User):
+        pass
+
+
+class Migration(migrations.Migration):
+    ## backfill_application_parties commits every chunk on its own
+    atomic = False
+
+    dependencies = [
+        ('api', '0003_application_party_relations'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
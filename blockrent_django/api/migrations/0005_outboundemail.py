@@ -0,0 +1,34 @@
+# Generated by Django 2.1.15 on 2026-10-18 14:06
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_backfill_application_parties'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('NEW', 'NEW'), ('FAILED', 'FAILED'), ('SENT', 'SENT'), ('DEAD', 'DEAD')], default='NEW', max_length=16)),
+                ('subject', models.CharField(max_length=256)),
+                ('body', models.TextField()),
+                ('from_email', models.CharField(blank=True, max_length=256)),
+                ('to', models.CharField(max_length=1024)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='outboundemail',
+            index_together={('status', 'next_attempt_at')},
+        ),
+    ]
@@ -0,0 +1,98 @@
+from django.db import migrations, models
+
+from api.core.numbers import parse_decimal, format_decimal
+
+NUMERIC_FIELDS = {
+    'total_contract_value': dict(max_digits=14, decimal_places=2, db_index=True),
+    'annual_rent': dict(max_digits=14, decimal_places=2, db_index=True),
+    'property_size': dict(max_digits=10, decimal_places=2, db_index=True),
+    'deposit_amount': dict(max_digits=14, decimal_places=2, db_index=True),
+    'term_percent': dict(max_digits=5, decimal_places=2),
+}
+
+CHUNK_SIZE = 500
+
+
+def iter_rows(Application, source):
+    last_pk = 0
+    while True:
+        rows = list(Application.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', *source)[:CHUNK_SIZE])
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_pk = rows[-1][0]
+
+
+def parse_legacy(field, value):
+    return parse_decimal(value, NUMERIC_FIELDS[field]['decimal_places'], NUMERIC_FIELDS[field]['max_digits'])
+
+
+def check_legacy_values(Application):
+    """
+    Stops the migration with the legacy values that aren't a single number
+    fitting the typed column, they have to be corrected by hand first
+    """
+    fields = list(NUMERIC_FIELDS)
+    invalid = []
+    for row in iter_rows(Application, fields):
+        for field, value in zip(fields, row[1:]):
+            try:
+                parse_legacy(field, value)
+            except ValueError:
+                invalid.append('application %s %s=%r' % (row[0], field, value))
+    if invalid:
+        raise RuntimeError('%s application amounts/sizes can\'t be typed, correct them before migrating:\n  %s' % (
+            len(invalid), '\n  '.join(invalid[:100])))
+
+
+def copy_values(Application, convert, source_suffix, target_suffix):
+    fields = list(NUMERIC_FIELDS)
+    for row in iter_rows(Application, [field + source_suffix for field in fields]):
+        Application.objects.filter(pk=row[0]).update(**dict(
+            (field + target_suffix, convert(field, value)) for field, value in zip(fields, row[1:])))
+
+
+def forwards(apps, schema_editor):
+    Application = apps.get_model('api', 'Application')
+    check_legacy_values(Application)
+    copy_values(Application, parse_legacy, '', '_typed')
+
+
+def backwards(apps, schema_editor):
+    copy_values(apps.get_model('api', 'Application'), lambda field, value: format_decimal(value), '_typed', '')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name=name + '_typed',
+            field=models.DecimalField(null=True, blank=True, max_digits=options['max_digits'],
+                                      decimal_places=options['decimal_places']),
+        ) for name, options in NUMERIC_FIELDS.items()
+    ] + [
+        migrations.RunPython(forwards, backwards),
+    ] + [
+        migrations.RemoveField(
+            model_name='application',
+            name=name,
+        ) for name in NUMERIC_FIELDS
+    ] + [
+        migrations.RenameField(
+            model_name='application',
+            old_name=name + '_typed',
+            new_name=name,
+        ) for name in NUMERIC_FIELDS
+    ] + [
+        migrations.AlterField(
+            model_name='application',
+            name=name,
+            field=models.DecimalField(null=True, blank=True, **options),
+        ) for name, options in NUMERIC_FIELDS.items() if options.get('db_index')
+    ]
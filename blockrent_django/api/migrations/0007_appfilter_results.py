@@ -0,0 +1,39 @@
+# Generated by Django 2.1.15 on 2026-10-18 14:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_typed_application_numbers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppFilterResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appfilter',
+            name='materialized_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='appfilterresult',
+            name='app_filter',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='api.AppFilter'),
+        ),
+        migrations.AddField(
+            model_name='appfilterresult',
+            name='application',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='filter_results', to='api.Application'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='appfilterresult',
+            unique_together={('app_filter', 'application')},
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.15 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+from api.core.summary import rebuild_summary
+
+
+def build_summary(apps, schema_editor):
+    rebuild_summary(apps.get_model('api', 'Application'), apps.get_model('api', 'UserApplicationSummary'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_appfilter_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserApplicationSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_id', models.CharField(max_length=256)),
+                ('status', models.CharField(max_length=64)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='userapplicationsummary',
+            unique_together={('account_id', 'status')},
+        ),
+        migrations.RunPython(build_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+from api.core.search import SQLiteFTSBackend, create_sqlite_index, rebuild_sqlite_index
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        create_sqlite_index(cursor, SQLiteFTSBackend.table)
+        rebuild_sqlite_index(cursor, SQLiteFTSBackend.table)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS %s' % SQLiteFTSBackend.table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_userapplicationsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_application_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='application',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
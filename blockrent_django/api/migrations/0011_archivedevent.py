@@ -0,0 +1,28 @@
+# Generated by Django 2.1.15 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_application_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedEvent',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('NEW', 'NEW'), ('HANDLED', 'HANDLED'), ('IGNORED', 'IGNORED')], max_length=512)),
+                ('referenceid', models.CharField(blank=True, db_index=True, max_length=128)),
+                ('what', models.CharField(max_length=64)),
+                ('who', models.CharField(max_length=512)),
+                ('when', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ('-id',),
+            },
+        ),
+    ]
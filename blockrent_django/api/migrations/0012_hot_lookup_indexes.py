@@ -0,0 +1,52 @@
+# Generated by Django 2.1.15 on 2026-10-18 14:31
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_ejari_nos(apps, schema_editor):
+    Application = apps.get_model('api', 'Application')
+    duplicates = list(Application.objects.using(schema_editor.connection.alias).values('ejari_no')
+                      .annotate(count=Count('id')).filter(count__gt=1).values_list('ejari_no', flat=True)[:20])
+    if duplicates:
+        raise RuntimeError('ejari_no is becoming unique, resolve the applications sharing the contract numbers %s '
+                           'before migrating' % ', '.join(duplicates))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_archivedevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_ejari_nos, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='application',
+            name='ejari_no',
+            field=models.CharField(max_length=128, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='application',
+            name='internal_id',
+            field=models.CharField(db_index=True, max_length=128),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='referenceid',
+            field=models.CharField(blank=True, db_index=True, max_length=128),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='who',
+            field=models.CharField(db_index=True, max_length=512),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['tenant_id', 'status'], name='api_app_tenant_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['owner_id', 'status'], name='api_app_owner_status_idx'),
+        ),
+    ]
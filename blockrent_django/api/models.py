@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, AbstractBaseUser, BaseUserManager
 from django.db.models import Model
+from django.utils import timezone
 from tastypie.models import create_api_key
 
 # Create your models here.
@@ -100,6 +101,13 @@ class User(AbstractBaseUser):
     @property
     def full_name(self):
         return '%s %s' % (self.first_name, self.last_name)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(User, cls).from_db(db, field_names, values)
+        ## remembered so post_save handlers can tell what a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
     
     def has_module_perms(self, app_label):
         return self.is_admin
@@ -167,17 +175,21 @@ class Application(models.Model):
     is_confirmed_by_tenant = models.CharField(max_length=64, default="NO")
     is_confirmed_by_owner = models.CharField(max_length=64, default="NO")
     
-    ejari_no = models.CharField(max_length=128)  #contractNo
+    ejari_no = models.CharField(max_length=128, unique=True)  #contractNo
     premis_no = models.CharField(max_length=128)  #premiseNo
-    internal_id = models.CharField(max_length=128)
+    internal_id = models.CharField(max_length=128, db_index=True)
     tenant_id = models.CharField(max_length=512)
     owner_id = models.CharField(max_length=512)
+    tenant_user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL,
+                                    related_name='tenant_applications')
+    owner_user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL,
+                                   related_name='owner_applications')
     
     address = models.CharField(max_length=256)  #address
-    total_contract_value = models.CharField(max_length=128,  blank=True)
+    total_contract_value = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True, db_index=True)
     property_usage = models.CharField(max_length=64, choices=APPLICATION_PROPERTY_USAGE, default='RESIDENTIAL')
-    annual_rent = models.CharField(max_length=64, blank=True)
-    property_size = models.CharField(max_length=64, blank=True)
+    annual_rent = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True, db_index=True)
+    property_size = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, db_index=True)
     currency_type = models.CharField(max_length=32, choices=CURRENCY_TYPE, blank=True)
     
     start_date = models.DateField(blank=True)  #contractStartDate
@@ -187,17 +199,69 @@ class Application(models.Model):
 
     #deposit Details
     deposit_term = models.CharField(max_length=64, choices=APPLICATION_DEPOSIT_TERMS, default='Fixed Amount')
-    deposit_amount = models.CharField(max_length=128, blank=True)
-    term_percent = models.CharField(max_length=10, blank=True)
+    deposit_amount = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True, db_index=True)
+    term_percent = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     tenant_dispute_claim = models.CharField(max_length=2048, blank=True)
     owner_dispute_claim = models.CharField(max_length=2048, blank=True)
-    
+
+    class Meta:
+        ## the account's applications (tenant_id = ? OR owner_id = ?), optionally by status
+        indexes = [
+            models.Index(fields=['tenant_id', 'status'], name='api_app_tenant_status_idx'),
+            models.Index(fields=['owner_id', 'status'], name='api_app_owner_status_idx'),
+        ]
+
     def __str__(self):
         return self.ejari_no
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Application, cls).from_db(db, field_names, values)
+        ## remembered so post_save handlers can tell what a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        ## tenant_id/owner_id are kept readable until every client reads the relations
+        update_fields = kwargs.get('update_fields')
+        synced = [self.sync_party(account_field, relation, update_fields)
+                  for account_field, relation in (('tenant_id', 'tenant_user'), ('owner_id', 'owner_user'))]
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields).union(field for field in synced if field)
+        super(Application, self).save(*args, **kwargs)
+
+    def sync_party(self, account_field, relation, update_fields=None):
+        """
+        Fills the party relation from its account id when it's unset or the
+        account id changed since the row was loaded, or the account id from
+        the relation when that's missing. Returns the field it set, if any.
+        """
+        if update_fields is not None and account_field not in update_fields and relation not in update_fields:
+            return None
+        account_id = getattr(self, account_field)
+        user_id = getattr(self, relation + '_id')
+        if not account_id:
+            if user_id is None:
+                return None
+            setattr(self, account_field, getattr(self, relation).account_id)
+            return account_field
+
+        loaded = getattr(self, '_loaded_values', None) or {}
+        if user_id is not None and loaded.get(account_field, account_id) == account_id:
+            return None
+        ## the relation was assigned along with the new account id
+        field = self._meta.get_field(relation)
+        if user_id is not None and field.is_cached(self) and field.get_cached_value(self).account_id == account_id:
+            return None
+        user = User.objects.filter(account_id=account_id).first()
+        if user is None and user_id is None:
+            return None
+        setattr(self, relation, user)
+        return relation
     
     
 """
@@ -215,9 +279,9 @@ class Event(models.Model):
     
     status = models.CharField(max_length=512, choices=EVENT_STATUS_CHOICES, default='NEW')
     
-    referenceid = models.CharField(max_length=128, blank=True)
+    referenceid = models.CharField(max_length=128, blank=True, db_index=True)
     what = models.CharField(max_length=64)
-    who = models.CharField(max_length=512)
+    who = models.CharField(max_length=512, db_index=True)
     when = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -227,6 +291,28 @@ class Event(models.Model):
         return self.referenceid
 
 
+"""
+ArchivedEvent Model, Events moved out of the Event table by the archive_events
+job. Rows keep the id they had in Event.
+"""
+
+
+class ArchivedEvent(models.Model):
+    id = models.IntegerField(primary_key=True)
+    status = models.CharField(max_length=512, choices=Event.EVENT_STATUS_CHOICES)
+    referenceid = models.CharField(max_length=128, blank=True, db_index=True)
+    what = models.CharField(max_length=64)
+    who = models.CharField(max_length=512)
+    when = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('-id', )
+
+    def __str__(self):
+        return self.referenceid
+
+
 class AppFilter(models.Model):
     APPLICATION_PROPERTY_USAGE = (
         ('', ''),
@@ -247,9 +333,90 @@ class AppFilter(models.Model):
     start_date = models.CharField(max_length=64, blank=True)
     end_date = models.CharField(max_length=64, blank=True)
     address = models.CharField(max_length=512, blank=True)
+    materialized_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.filter_name
 
+    @property
+    def is_heavy(self):
+        ## name and address criteria are substring scans, their results are materialized
+        return bool(self.tenant_name or self.owner_name or self.address)
+
+
+"""
+AppFilterResult Model, materialized results of heavy AppFilters
+"""
+
+
+class AppFilterResult(models.Model):
+    app_filter = models.ForeignKey(AppFilter, on_delete=models.CASCADE, related_name='results')
+    application = models.ForeignKey(Application, on_delete=models.CASCADE, related_name='filter_results')
+
+    class Meta:
+        unique_together = (('app_filter', 'application'), )
+
+
+"""
+UserApplicationSummary Model, per account count of applications by status
+maintained by api.core.summary, PENDING_CONFIRMATION counts the NEW
+applications the account hasn't confirmed yet
+"""
+
+
+class UserApplicationSummary(models.Model):
+    PENDING_CONFIRMATION = 'PENDING_CONFIRMATION'
+
+    account_id = models.CharField(max_length=256)
+    status = models.CharField(max_length=64)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('account_id', 'status'), )
+
+    def __str__(self):
+        return '%s %s %s' % (self.account_id, self.status, self.count)
+
+
+"""
+OutboundEmail Model, outbox of transactional emails. Rows are written inside
+the request transaction and delivered by the process_email_outbox worker.
+"""
+
+
+class OutboundEmail(models.Model):
+    NEW = 'NEW'
+    FAILED = 'FAILED'
+    SENT = 'SENT'
+    DEAD = 'DEAD'
+
+    EMAIL_STATUS_CHOICES = (
+        (NEW, 'NEW'),
+        (FAILED, 'FAILED'),
+        (SENT, 'SENT'),
+        (DEAD, 'DEAD'),
+    )
+
+    status = models.CharField(max_length=16, choices=EMAIL_STATUS_CHOICES, default=NEW)
+    subject = models.CharField(max_length=256)
+    body = models.TextField()
+    from_email = models.CharField(max_length=256, blank=True)
+    to = models.CharField(max_length=1024)  #comma separated recipients
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = (('status', 'next_attempt_at'), )
+
+    def __str__(self):
+        return '%s %s' % (self.to, self.subject)
+
+    @property
+    def recipients(self):
+        return [address for address in self.to.split(',') if address]
+
 
 models.signals.post_save.connect(create_api_key, sender=User)
\ No newline at end of file
@@ -1,15 +1,36 @@
 # api/resources.py
 
 from tastypie.authorization import Authorization, DjangoAuthorization
-from tastypie.authentication import BasicAuthentication, ApiKeyAuthentication
+from tastypie.authentication import BasicAuthentication
 from tastypie.resources import ModelResource, ALL, ALL_WITH_RELATIONS
 from api.models import User, Application, Event, Registration, AppFilter
-from api.core.helpers import send_application_confirm_email, send_account_creation_email
+from api.core.archive import event_history
+from api.core.audit import audit_events
+from api.core.authentication import CachedApiKeyAuthentication
+from api.core.confirmation import CONFIRMED, CONFLICT, NOT_FOUND, confirm_applications
+from api.core.etags import etag_matches, application_etag, collection_etag
+from api.core.export import EXPORT_FORMATS, iter_chunks, stream_export
+from api.core.filters import filter_results
+from api.core.live import event_stream, get_notifier
+from api.core.metrics import serialization_timer
+from api.core.numbers import parse_decimal_field, format_decimal
+from api.core.pagination import KeysetPaginator
+from api.core.parties import PartyResolver
+from api.core.search import get_search_backend
+from api.core.summary import get_summary
+from api.core.queries import count_queries
+from api.core.registration import BulkRegistration, RegistrationFormError, parse_registration_form
+from api.core.routing import read_from_replica, replica_reads
 from django.contrib.auth import authenticate, login, logout
+from django.conf import settings
 from django.conf.urls import url
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from tastypie.exceptions import BadRequest
 from tastypie.http import HttpUnauthorized, HttpForbidden
 from tastypie.resources import convert_post_to_patch
-import uuid
+import json
+import logging
 from django.core.exceptions import (
     ObjectDoesNotExist, MultipleObjectsReturned, ValidationError, FieldDoesNotExist
 )
@@ -18,8 +39,26 @@ from tastypie.utils import (
     trailing_slash,
 )
 from tastypie import http
-from random import choice
-from string import ascii_letters, digits
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMixin(object):
+    """
+    Adds the time spent dehydrating and serializing, and the size of list
+    pages, to the request's metrics (api.core.metrics.RequestMetricsMiddleware)
+    """
+
+    def full_dehydrate(self, bundle, for_list=False):
+        with serialization_timer(bundle.request):
+            return super(MetricsMixin, self).full_dehydrate(bundle, for_list=for_list)
+
+    def serialize(self, request, data, format, options=None):
+        timings = getattr(request, 'timings', None)
+        if timings is not None and isinstance(data, dict) and isinstance(data.get('objects'), list):
+            timings.objects = len(data['objects'])
+        with serialization_timer(request):
+            return super(MetricsMixin, self).serialize(request, data, format, options=options)
 
 
 """
@@ -42,12 +81,12 @@ user fields:
 """
 
 
-class UserResource(ModelResource):
+class UserResource(MetricsMixin, ModelResource):
     class Meta:
         queryset = User.objects.all()
         resource_name = 'users'
         authorization = DjangoAuthorization()
-        authentication = ApiKeyAuthentication()
+        authentication = CachedApiKeyAuthentication()
         filtering = {
             'account_id': 'exact',
             'first_name': 'iexact',
@@ -63,6 +102,8 @@ class UserResource(ModelResource):
                 self.wrap_view('login'), name='api_login'),
             url(r'^(?P<resource_name>%s)/logout%s$' % (self._meta.resource_name, trailing_slash()),
                 self.wrap_view('logout'), name='api_logout'),
+            url(r'^(?P<resource_name>%s)/(?P<pk>\d+)/summary%s$' % (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('summary'), name='api_user_summary'),
         ]
 
     def get_api_key_for_user(self, user):
@@ -98,6 +139,27 @@ class UserResource(ModelResource):
                 'reason': 'incorrect'
             }, HttpUnauthorized)
 
+    def summary(self, request, **kwargs):
+        """
+        Dashboard counters of the user's applications by status, read from
+        the UserApplicationSummary table
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        if str(request.user.pk) == kwargs['pk']:
+            account_id = request.user.account_id
+        elif request.user.is_admin:
+            try:
+                account_id = User.objects.values_list('account_id', flat=True).get(pk=kwargs['pk'])
+            except User.DoesNotExist:
+                return http.HttpNotFound()
+        else:
+            return self.create_response(request, {'success': False}, HttpForbidden)
+
+        return self.create_response(request, get_summary(account_id))
+
     def logout(self, request, **kwargs):
         self.method_check(request, allowed=['get'])
         if request.user and request.user.is_authenticated:
@@ -124,12 +186,102 @@ Application fields:
 """
 
 
-class ApplicationResource(ModelResource):
+class ApplicationPartiesMixin(object):
+    """
+    Adds tenant/owner details to application bundles, the users are read
+    from the request scoped PartyResolver so a page of applications costs
+    one user query instead of two per row. Rows with the tenant_user/owner_user
+    relations set are joined through select_related and need no lookup at all.
+    """
+
+    def dehydrate_parties(self, bundle):
+        application = bundle.obj
+        tenant = application.tenant_user
+        owner = application.owner_user
+        if tenant is None or owner is None:
+            ## not backfilled yet, fall back to the legacy account id columns
+            resolver = PartyResolver.for_request(bundle.request)
+            resolver.prefetch_applications([application])
+            tenant = tenant or resolver.get(application.tenant_id)
+            owner = owner or resolver.get(application.owner_id)
+        add_party_fields(bundle, 'tenant', tenant)
+        add_party_fields(bundle, 'owner', owner)
+        return bundle
+
+
+NUMERIC_APPLICATION_FIELDS = ('total_contract_value', 'annual_rent', 'property_size', 'deposit_amount', 'term_percent')
+NUMERIC_FILTERS = ('exact', 'gt', 'gte', 'lt', 'lte', 'range')
+
+
+class ApplicationNumbersMixin(object):
+    """
+    The amounts and sizes of applications are typed columns, the API keeps
+    rendering them as the plain strings they used to be stored as and accepts
+    the same free text on input.
+    """
+
+    def dehydrate_total_contract_value(self, bundle):
+        return format_decimal(bundle.obj.total_contract_value)
+
+    def dehydrate_annual_rent(self, bundle):
+        return format_decimal(bundle.obj.annual_rent)
+
+    def dehydrate_property_size(self, bundle):
+        return format_decimal(bundle.obj.property_size)
+
+    def dehydrate_deposit_amount(self, bundle):
+        return format_decimal(bundle.obj.deposit_amount)
+
+    def dehydrate_term_percent(self, bundle):
+        return format_decimal(bundle.obj.term_percent)
+
+    def hydrate(self, bundle):
+        for field in NUMERIC_APPLICATION_FIELDS:
+            if field in bundle.data:
+                try:
+                    bundle.data[field] = parse_decimal_field(Application._meta.get_field(field), bundle.data[field])
+                except ValueError as e:
+                    raise BadRequest('%s: %s' % (field, e))
+        return super(ApplicationNumbersMixin, self).hydrate(bundle)
+
+
+class ExportMixin(object):
+    """
+    ``<resource>/export/`` streams every row matching the list filters as CSV
+    or NDJSON (``?format=ndjson``). Rows are read in primary key order one
+    chunk at a time with the parties of each chunk resolved together, so memory
+    stays flat however many rows are exported.
+
+    Resources provide ``export_fields``, ``projected_columns`` and ``project_rows``.
+    """
+
+    def export_url(self):
+        return url(r'^(?P<resource_name>%s)/export%s$' % (self._meta.resource_name, trailing_slash()),
+                   self.wrap_view('export'), name='api_%s_export' % self._meta.resource_name)
+
+    def export(self, request, **kwargs):
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise BadRequest("Unsupported export format: %s" % export_format)
+
+        base_bundle = self.build_bundle(request=request)
+        objects = self.obj_get_list(bundle=base_bundle, **self.remove_api_resource_names(kwargs))
+        fields = self.export_fields(request)
+        chunks = iter_chunks(objects.values(*self.projected_columns(fields)), settings.EXPORT_CHUNK_SIZE)
+        rows = (row for chunk in chunks for row in self.project_rows(chunk, fields, PartyResolver()))
+        return stream_export(rows, fields, export_format, self._meta.resource_name)
+
+
+class ApplicationResource(MetricsMixin, ExportMixin, ApplicationNumbersMixin, ApplicationPartiesMixin, ModelResource):
     class Meta:
-        queryset = Application.objects.all()
+        queryset = Application.objects.select_related('tenant_user', 'owner_user')
         resource_name = 'applications'
         authorization = Authorization()
-        authentication = ApiKeyAuthentication()
+        authentication = CachedApiKeyAuthentication()
         filtering = {
             'application_id': 'exact',
             'internal_id': 'iexact',
@@ -137,34 +289,105 @@ class ApplicationResource(ModelResource):
             'onwer_id': 'iexact',
             'application_status': ALL,
             'application_address': ALL,
+            'annual_rent': NUMERIC_FILTERS,
+            'total_contract_value': NUMERIC_FILTERS,
+            'property_size': NUMERIC_FILTERS,
+            'deposit_amount': NUMERIC_FILTERS,
         }
+        ordering = ['annual_rent', 'total_contract_value', 'property_size', 'deposit_amount', 'start_date',
+                    'end_date', 'created_at']
 
     def dehydrate(self, bundle):
-        tenant = User.objects.get(account_id=bundle.data['tenant_id'])
-        owner = User.objects.get(account_id=bundle.data['owner_id'])
-        bundle.data['tenant_name'] = tenant.full_name
-        bundle.data['tenant_first_name'] = tenant.first_name
-        bundle.data['tenant_last_name'] = tenant.last_name
-        bundle.data['tenant_phone_number'] = tenant.contact_number
-        bundle.data['tenant_email'] = tenant.email
-
-        bundle.data['owner_name'] = owner.full_name
-        bundle.data['owner_first_name'] = owner.first_name
-        bundle.data['owner_last_name'] = owner.last_name
-        bundle.data['owner_phone_number'] = owner.contact_number
-        bundle.data['owner_email'] = owner.email
+        self.dehydrate_parties(bundle)
         return super(ApplicationResource, self).dehydrate(bundle)
 
+    def prepend_urls(self):
+        return [
+            url(r'^(?P<resource_name>%s)/search%s$' % (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('search'), name='api_application_search'),
+            self.export_url(),
+        ]
+
+    @read_from_replica
     def get_list(self, request, **kwargs):
         base_bundle = self.build_bundle(request=request)
         objects = self.obj_get_list(bundle=base_bundle, **self.remove_api_resource_names(kwargs))
+
+        etag = collection_etag(objects, request, self.determine_format(request))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response = self.create_list_response(request, objects)
+        response['ETag'] = etag
+        return response
+
+    @read_from_replica
+    def get_detail(self, request, **kwargs):
+        return super(ApplicationResource, self).get_detail(request, **kwargs)
+
+    def search(self, request, **kwargs):
+        """
+        Ranked search over address, ejari/premise numbers and party names,
+        ``?q=<words>`` with limit/offset pagination
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        paginator = self._meta.paginator_class(request.GET, [], resource_uri=request.path, limit=self._meta.limit,
+                                               max_limit=self._meta.max_limit)
+        limit = paginator.get_limit()
+        offset = paginator.get_offset()
+
+        ids = get_search_backend().search(request.GET.get('q', ''), limit + 1, offset)
+        has_more = len(ids) > limit
+        ids = ids[:limit]
+        applications = self._meta.queryset.in_bulk(ids)
+        objects = [applications[pk] for pk in ids if pk in applications]
+
+        PartyResolver.for_request(request).prefetch_applications(objects)
+        bundles = [
+            self.full_dehydrate(self.build_bundle(obj=obj, request=request), for_list=True)
+            for obj in objects
+        ]
+
+        to_be_serialized = {
+            'meta': {
+                'limit': limit,
+                'offset': offset,
+                'previous': paginator.get_previous(limit, offset),
+                'next': paginator._generate_uri(limit, offset + limit) if has_more else None,
+            },
+            self._meta.collection_name: bundles,
+        }
+        to_be_serialized = self.alter_list_data_to_serialize(request, to_be_serialized)
+        return self.create_response(request, to_be_serialized)
+
+    def create_list_response(self, request, objects, resource_uri=None):
+        """
+        Sorts, paginates and serializes ``objects`` the way get_list does
+        """
         sorted_objects = self.apply_sorting(objects, options=request.GET)
 
-        paginator = self._meta.paginator_class(request.GET, sorted_objects, resource_uri=self.get_resource_uri(),
+        ## ?fields=a,b,c selects just those columns and skips the per object Bundle
+        fields = self.get_projection(request)
+        if fields:
+            sorted_objects = sorted_objects.values(*self.projected_columns(fields))
+
+        paginator = self._meta.paginator_class(request.GET, sorted_objects,
+                                               resource_uri=resource_uri or self.get_resource_uri(),
                                                limit=self._meta.limit, max_limit=self._meta.max_limit,
                                                collection_name=self._meta.collection_name)
         to_be_serialized = paginator.page()
 
+        if fields:
+            to_be_serialized[self._meta.collection_name] = self.project_rows(
+                to_be_serialized[self._meta.collection_name], fields, PartyResolver.for_request(request))
+            return self.create_response(request, to_be_serialized)
+
+        # Load the parties of the whole page at once, dehydrate reads from it.
+        PartyResolver.for_request(request).prefetch_applications(to_be_serialized[self._meta.collection_name])
+
         # Dehydrate the bundles in preparation for serialization.
         bundles = [
             self.full_dehydrate(self.build_bundle(obj=obj, request=request), for_list=True)
@@ -176,13 +399,62 @@ class ApplicationResource(ModelResource):
 
         return self.create_response(request, to_be_serialized)
 
+    def get_projection(self, request):
+        fields = [name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()]
+        unknown = [name for name in fields if name not in self.fields and name not in PARTY_FIELDS]
+        if unknown:
+            raise BadRequest("Unknown fields: %s" % ', '.join(unknown))
+        return fields
+
+    def projected_columns(self, fields):
+        columns = set(['id'])
+        for name in fields:
+            if name in PARTY_FIELDS:
+                role = name.split('_', 1)[0]
+                columns.update(['%s_id' % role, '%s_user_id' % role])
+                columns.update('%s_user__%s' % (role, column) for column in PARTY_COLUMNS)
+            elif self.fields[name].attribute:
+                columns.add(self.fields[name].attribute)
+        return columns
+
+    def export_fields(self, request):
+        return self.get_projection(request) or \
+            [name for name in self.fields if name != 'resource_uri'] + list(PARTY_FIELDS)
+
+    def project_rows(self, rows, fields, resolver):
+        """
+        Builds the list entries straight from ``values()`` rows, in the same
+        shape full_dehydrate produces for the requested fields
+        """
+        roles = set(name.split('_', 1)[0] for name in fields if name in PARTY_FIELDS)
+        resolver.prefetch([row['%s_id' % role] for row in rows for role in roles
+                           if row['%s_user_id' % role] is None])
+
+        base_uri = self.get_resource_uri()
+        objects = []
+        for row in rows:
+            parties = dict((role, projected_party(row, role, resolver)) for role in roles)
+            data = {}
+            for name in fields:
+                if name in PARTY_FIELDS:
+                    role, field = name.split('_', 1)
+                    data[name] = parties[role][field]
+                elif name == 'resource_uri':
+                    data[name] = '%s%s/' % (base_uri, row['id'])
+                elif name in NUMERIC_APPLICATION_FIELDS:
+                    data[name] = format_decimal(row[self.fields[name].attribute])
+                else:
+                    data[name] = row[self.fields[name].attribute]
+            objects.append(data)
+        return objects
+
 
-class ApplicationDetailResource(ModelResource):
+class ApplicationDetailResource(MetricsMixin, ApplicationNumbersMixin, ApplicationPartiesMixin, ModelResource):
     class Meta:
-        queryset = Application.objects.all()
+        queryset = Application.objects.select_related('tenant_user', 'owner_user')
         resource_name = 'application-detail'
         authorization = Authorization()
-        authentication = ApiKeyAuthentication()
+        authentication = CachedApiKeyAuthentication()
         filtering = {
             'application_id': 'exact',
             'internal_id': 'iexact',
@@ -193,25 +465,23 @@ class ApplicationDetailResource(ModelResource):
         }
 
     def dehydrate(self, bundle):
-        tenant = User.objects.get(account_id=bundle.data['tenant_id'])
-        owner = User.objects.get(account_id=bundle.data['owner_id'])
-        bundle.data['tenant_name'] = tenant.full_name
-        bundle.data['tenant_first_name'] = tenant.first_name
-        bundle.data['tenant_last_name'] = tenant.last_name
-        bundle.data['tenant_phone_number'] = tenant.contact_number
-        bundle.data['tenant_email'] = tenant.email
-
-        bundle.data['owner_name'] = owner.full_name
-        bundle.data['owner_first_name'] = owner.first_name
-        bundle.data['owner_last_name'] = owner.last_name
-        bundle.data['owner_phone_number'] = owner.contact_number
-        bundle.data['owner_email'] = owner.email
+        self.dehydrate_parties(bundle)
         return super(ApplicationDetailResource, self).dehydrate(bundle)
 
+    @read_from_replica
     def get_detail(self, request, **kwargs):
         #applications = super(ApplicationResource, self).get_object_list(request)
         #return applications.filter(Q(tenant_id=request.user.account_id) | Q(owner_id=request.user.account_id))
         basic_bundle = self.build_bundle(request=request)
+        format = self.determine_format(request)
+
+        ## check If-None-Match against updated_at alone before loading and dehydrating the application
+        version = list(Application.objects.filter(**self.remove_api_resource_names(kwargs))
+                       .values_list('pk', 'updated_at')[:2])
+        if len(version) == 1:
+            etag = application_etag(version[0][0], version[0][1], format)
+            if etag_matches(request, etag):
+                return not_modified(etag)
 
         try:
             obj = self.cached_obj_get(bundle=basic_bundle, **self.remove_api_resource_names(kwargs))
@@ -223,7 +493,9 @@ class ApplicationDetailResource(ModelResource):
         bundle = self.build_bundle(obj=obj, request=request)
         bundle = self.full_dehydrate(bundle)
         bundle = self.alter_detail_data_to_serialize(request, bundle)
-        return self.create_response(request, bundle)
+        response = self.create_response(request, bundle)
+        response['ETag'] = application_etag(obj.pk, obj.updated_at, format)
+        return response
 
     def patch_detail(self, request, **kwargs):
         request = convert_post_to_patch(request)
@@ -250,12 +522,14 @@ class ApplicationDetailResource(ModelResource):
         deserialized = self.deserialize(request, request.body,
                                         format=request.META.get('CONTENT_TYPE', 'application/json'))
         #print(request.user)
-        self.update_application(request, deserialized)
+        confirmation = self.update_application(request, deserialized)
         #self.update_in_place(request, bundle, deserialized)
         #print(deserialized)
         #print(request)
 
         if not self._meta.always_return_data:
+            if confirmation is not None:
+                return self.create_response(request, confirmation, http.HttpAccepted)
             return http.HttpAccepted()
         else:
             # Invalidate prefetched_objects_cache for bundled object
@@ -267,31 +541,30 @@ class ApplicationDetailResource(ModelResource):
 
     def update_application(self, request, deserialized):
         user = request.user
-        application = Application.objects.get(pk=deserialized['appId'])
-        try:
-            if deserialized['confirm']:
-                if application.owner_id == user.account_id:
-                    application.is_confirmed_by_owner = 'YES'
-                else:
-                    application.is_confirmed_by_tenant = 'YES'
-                if application.is_confirmed_by_tenant == application.is_confirmed_by_owner == 'YES':
-                    application.status = 'CONFIRMED'
-        except:
-            pass
+        application = Application.objects.select_related('tenant_user', 'owner_user').get(pk=deserialized['appId'])
         application.ejari_no = deserialized['leaseApplicationDetails']['contractNo']
         application.start_date = deserialized['leaseApplicationDetails']['contractStartDate']
         application.end_date = deserialized['leaseApplicationDetails']['contractEndDate']
         application.address = deserialized['leaseApplicationDetails']['address']
         application.premis_no = deserialized['leaseApplicationDetails']['premiseNo']
-        application.total_contract_value = deserialized['leaseApplicationDetails']['securityDepositAmount']
-        application.save()
+        try:
+            application.total_contract_value = parse_decimal_field(
+                Application._meta.get_field('total_contract_value'),
+                deserialized['leaseApplicationDetails']['securityDepositAmount'])
+        except ValueError as e:
+            raise BadRequest('securityDepositAmount: %s' % e)
 
-        registrationEvent = Event(
-            referenceid=application.id,
-            what="APPLICATION CONFIRMATION",
-            who=user.account_id,
-        )
-        registrationEvent.save()
+        try:
+            with transaction.atomic():
+                ## the confirmation flags and status are only changed by the conditional update
+                application.save(update_fields=['ejari_no', 'start_date', 'end_date', 'address', 'premis_no',
+                                                'total_contract_value', 'updated_at'])
+                if deserialized.get('confirm'):
+                    return confirm_applications([application.internal_id], user.account_id)[application.internal_id]
+                with audit_events() as audit:
+                    audit.record(referenceid=application.id, what="APPLICATION CONFIRMATION", who=user.account_id)
+        except IntegrityError:
+            raise BadRequest("contractNo '%s' is already registered." % application.ejari_no)
 
 """
 Application fields:
@@ -309,50 +582,76 @@ Application fields:
     application_created_date
 """
 
-class ApplicationConfirmResource(ModelResource):
+class ApplicationConfirmResource(MetricsMixin, ApplicationNumbersMixin, ModelResource):
     class Meta:
-        queryset = Application.objects.all()
+        queryset = Application.objects.select_related('tenant_user', 'owner_user')
         resource_name = 'confirmApplication'
         authorization = DjangoAuthorization()
-        authentication = ApiKeyAuthentication()
-        
-    def obj_create(self, bundle, request=None, **kwargs):
-        
+        authentication = CachedApiKeyAuthentication()
+
+    def prepend_urls(self):
+        return [
+            url(r'^(?P<resource_name>%s)/bulk%s$' % (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('bulk_confirm'), name='api_bulk_confirm'),
+        ]
+
+    def may_confirm_for(self, request, userID):
+        ## parties confirm for themselves, only admins act on behalf of another account
+        return userID == request.user.account_id or request.user.is_admin
+
+    def bulk_confirm(self, request, **kwargs):
         """
-        Updates the status of the Application
+        Confirms a list of applications for the tenant or owner ``userID`` in
+        one transaction, responds with the outcome of every application id
         """
-        applicationID = bundle.data['applicationID']
-        userID = bundle.data['userID']
-        
+        self.method_check(request, allowed=['post'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        data = self.deserialize(request, request.body, format=request.META.get('CONTENT_TYPE', 'application/json'))
         try:
-             application_to_confirm = Application.objects.get(internal_id=applicationID) ##get application object
-             
-             tenant_id = application_to_confirm.tenant_id
-             owner_id = application_to_confirm.owner_id
-             
-             ## Update the Confirmation Field
-             if userID == tenant_id:
-                 application_to_confirm.is_confirmed_by_tenant = "YES"
-             elif userID == owner_id:
-                 application_to_confirm.is_confirmed_by_owner = "YES"
-                 
-             ## Update status of application if both have been confirmed
-             if application_to_confirm.is_confirmed_by_tenant == "YES" and application_to_confirm.is_confirmed_by_owner == "YES":
-                 application_to_confirm.status = "CONFIRMED"
-                 
-             application_to_confirm.save()
-             
-             ##Log the event
-             registrationEvent = Event(
-                     referenceid=applicationID,
-                     what="APPLICATION CONFIRMATION",
-                     who=userID,
-                     )
-             registrationEvent.save()
-             
-
-        except Application.DoesNotExist: ##if doesn't exist create a new object
-            pass        
+            applicationIDs = data['applicationIDs']
+            userID = data['userID']
+        except (KeyError, TypeError):
+            raise BadRequest('applicationIDs and userID are required')
+        if not isinstance(applicationIDs, list) or not applicationIDs:
+            raise BadRequest('applicationIDs must be a non-empty list')
+        if not all(isinstance(applicationID, str) for applicationID in applicationIDs):
+            raise BadRequest('applicationIDs must be strings')
+        if len(applicationIDs) > settings.BULK_CONFIRMATION_MAX_IDS:
+            raise BadRequest('at most %s applicationIDs per request' % settings.BULK_CONFIRMATION_MAX_IDS)
+        if not self.may_confirm_for(request, userID):
+            return self.create_response(request, {'success': False}, HttpForbidden)
+
+        results = confirm_applications(applicationIDs, userID)
+        return self.create_response(request, {
+            'objects': [dict(results[applicationID], applicationID=applicationID)
+                        for applicationID in dict.fromkeys(applicationIDs)],
+        })
+
+    def post_list(self, request, **kwargs):
+        """
+        Confirms the application for the tenant or owner ``userID``, responds
+        with the outcome and whether the application moved to CONFIRMED
+        """
+        data = self.deserialize(request, request.body, format=request.META.get('CONTENT_TYPE', 'application/json'))
+        try:
+            applicationID = data['applicationID']
+            userID = data['userID']
+        except (KeyError, TypeError):
+            raise BadRequest('applicationID and userID are required')
+        if not isinstance(applicationID, str):
+            raise BadRequest('applicationID must be a string')
+        if not self.may_confirm_for(request, userID):
+            return self.create_response(request, {'success': False}, HttpForbidden)
+
+        result = confirm_applications([applicationID], userID)[applicationID]
+        if result['status'] == NOT_FOUND:
+            return http.HttpNotFound()
+        if result['status'] == CONFLICT:
+            return self.create_response(request, result, http.HttpConflict)
+        return self.create_response(request, result,
+                                    http.HttpCreated if result['status'] == CONFIRMED else http.HttpResponse)
 
 
 """
@@ -363,13 +662,15 @@ Event fields:
     event_status
     event_occured_at
 """
-class EventResource(ModelResource):
+class EventResource(MetricsMixin, ExportMixin, ModelResource):
     class Meta:
-        limit = 0
+        limit = 20
+        max_limit = 100
+        paginator_class = KeysetPaginator
         queryset = Event.objects.all()
         resource_name = 'events'
         authorization = Authorization()
-        authentication = ApiKeyAuthentication()
+        authentication = CachedApiKeyAuthentication()
         filtering = {
             'event_id': 'exact',
             'event_type': 'iexact',
@@ -378,158 +679,183 @@ class EventResource(ModelResource):
             'event_status': ALL,
         }
 
+    def prepend_urls(self):
+        return [
+            url(r'^(?P<resource_name>%s)/stream%s$' % (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('stream'), name='api_event_stream'),
+            url(r'^(?P<resource_name>%s)/history/(?P<referenceid>[^/]+)%s$' % (
+                self._meta.resource_name, trailing_slash()), self.wrap_view('history'), name='api_event_history'),
+            self.export_url(),
+        ]
+
+    def stream(self, request, **kwargs):
+        """
+        Live feed (Server-Sent Events) of the events the authenticated account
+        follows, resumes after the Last-Event-ID header or ``?last_id=``
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        last_id = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_id')
+        try:
+            last_id = int(last_id) if last_id else None
+        except ValueError:
+            raise BadRequest("Invalid last event id '%s' provided. Please provide an integer." % last_id)
+
+        base_uri = self.get_resource_uri()
+        events = event_stream(get_notifier(), request.user.account_id, last_id,
+                              lambda row: dict(row, resource_uri='%s%s/' % (base_uri, row['id'])))
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def history(self, request, referenceid=None, **kwargs):
+        """
+        Events of ``referenceid``, newest first, including the ones moved to
+        the archive by archive_events. Paged with ``?after=<id>`` and ``limit``.
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        paginator = self._meta.paginator_class(request.GET, None, resource_uri=request.path,
+                                               limit=self._meta.limit, max_limit=self._meta.max_limit)
+        limit = paginator.get_limit()
+        with replica_reads(request):
+            rows, has_older = event_history(referenceid, limit, after=paginator.get_cursor('after'))
+
+        base_uri = self.get_resource_uri()
+        for row in rows:
+            row['resource_uri'] = None if row['archived'] else '%s%s/' % (base_uri, row['id'])
+        return self.create_response(request, {
+            'meta': {
+                'limit': limit,
+                'next': paginator._generate_cursor_uri(limit, 'after', rows[-1]['id']) if has_older else None,
+            },
+            'objects': rows,
+        })
+
     def dehydrate(self, bundle):
-        user = User.objects.get(account_id=bundle.data['who'])
-        bundle.data['username'] = user.full_name
+        user = PartyResolver.for_request(bundle.request).get(bundle.data['who'])
+        bundle.data['username'] = user.full_name if user is not None else ''
         return super(EventResource, self).dehydrate(bundle)
 
+    def export_fields(self, request):
+        return [name for name in self.fields if name != 'resource_uri'] + ['username']
+
+    def projected_columns(self, fields):
+        return set(['id', 'who']) | set(self.fields[name].attribute for name in fields
+                                          if name in self.fields and self.fields[name].attribute)
+
+    def project_rows(self, rows, fields, resolver):
+        resolver.prefetch([row['who'] for row in rows])
+        objects = []
+        for row in rows:
+            data = dict((name, row[self.fields[name].attribute]) for name in fields if name in self.fields)
+            user = resolver.get(row['who'])
+            data['username'] = user.full_name if user is not None else ''
+            objects.append(data)
+        return objects
+
+    @read_from_replica
+    def get_list(self, request, **kwargs):
+        base_bundle = self.build_bundle(request=request)
+        objects = self.obj_get_list(bundle=base_bundle, **self.remove_api_resource_names(kwargs))
+
+        ## the keyset paginator orders by -id itself, order_by isn't supported here
+        paginator = self._meta.paginator_class(request.GET, objects, resource_uri=self.get_resource_uri(),
+                                               limit=self._meta.limit, max_limit=self._meta.max_limit,
+                                               collection_name=self._meta.collection_name)
+        to_be_serialized = paginator.page()
+
+        # Load the users of the whole page at once, dehydrate reads from it.
+        PartyResolver.for_request(request).prefetch(
+            [event.who for event in to_be_serialized[self._meta.collection_name]])
+
+        bundles = [
+            self.full_dehydrate(self.build_bundle(obj=obj, request=request), for_list=True)
+            for obj in to_be_serialized[self._meta.collection_name]
+        ]
+
+        to_be_serialized[self._meta.collection_name] = bundles
+        to_be_serialized = self.alter_list_data_to_serialize(request, to_be_serialized)
+
+        return self.create_response(request, to_be_serialized)
+
+    @read_from_replica
+    def get_detail(self, request, **kwargs):
+        return super(EventResource, self).get_detail(request, **kwargs)
+
 """
 Registration Handler
 
 """
 
 
-class RegistrationResource(ModelResource):
+class RegistrationResource(MetricsMixin, ModelResource):
     
     class Meta:
         queryset = Registration.objects.all()
         resource_name = 'registerApplication'
         authorization = Authorization()
         allowed_methods = ['post']
+
+    def prepend_urls(self):
+        return [
+            url(r'^(?P<resource_name>%s)/bulk%s$' % (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('bulk_register'), name='api_bulk_register'),
+        ]
+
+    def bulk_register(self, request, **kwargs):
+        """
+        Registers a newline delimited stream of registrationForm payloads,
+        responds with one NDJSON result line per registration
+        """
+        self.method_check(request, allowed=['post'])
+        if CachedApiKeyAuthentication().is_authenticated(request) is not True:
+            return HttpUnauthorized()
+
+        lines = (line.decode('utf-8') for line in request)
+        results = BulkRegistration(chunk_size=settings.BULK_REGISTRATION_CHUNK_SIZE).run(lines)
+        return StreamingHttpResponse((json.dumps(result) + '\n' for result in results),
+                                     content_type='application/x-ndjson')
         
-    def obj_create(self, bundle, request=None, **kwargs):
-        registrationForm = bundle.data['registrationForm']
-
-        tenantDetails = registrationForm['personalDetails']
-        ownerDetails = registrationForm['otherParty']
-        leaseApplicationDetails = registrationForm['leaseApplicationDetails']
-        depositDetails = registrationForm['depositDetails']
-
-        tenant_first_name = tenantDetails['firstName']
-        tenant_last_name = tenantDetails['lastName']
-        owner_first_name = ownerDetails['firstName']
-        owner_last_name = ownerDetails['lastName']
-
-        try: ##try to find if registrant user exist
-             tenant = User.objects.get(email=tenantDetails['email'])
-             generated_tenant_id = tenant.account_id
-        except User.DoesNotExist: ##if doesn't exist create a new object
-            
-            ##excuse my shit way of doing this, randomly generating user_id
-            random_uid = str(uuid.uuid4().hex)
-            generated_tenant_id = random_uid
-            #generated_tenant_id = str(tenant_first_name)[0] + str(tenant_last_name)[0] + random_uid[0] + random_uid[1] + random_uid[2] + random_uid[3]
-            generated_tenant_password = random_uid[4] + random_uid[5] + random_uid[6] + random_uid[7] + str(tenant_first_name)[0] + str(tenant_last_name)[0]
-            name = generate_random_username()
-            print('tenant username: ' + name)
-            print('tenant password: ' + generated_tenant_password)
-
-            tenant = User(
-                account_id=generated_tenant_id,
-                account_type="TENANT",
-                first_name=tenant_first_name,
-                last_name=tenant_last_name,
-                contact_number=tenantDetails['phoneNumber'],
-                email=tenantDetails['email'],
-                username=name
-            )
-            tenant.set_password(generated_tenant_password)
-            tenant.save()
-
-            send_account_creation_email(tenant, generated_tenant_password)
-            
-            ##Log the event
-            registrationEvent = Event(
-                referenceid=generated_tenant_id,
-                what="TENANT REGISTRATION",
-                who=generated_tenant_id,
-                #when=bundle.data['createdAt']
-            )
-            registrationEvent.save()
-
-        try: ##try to find if owner user exist
-             owner = User.objects.get(email=ownerDetails['email'])
-             
-             generated_owner_id = owner.account_id
-        except User.DoesNotExist: ##if doesn't exist create a new object
-            
-            random_uid = str(uuid.uuid4().hex)
-            generated_owner_id = random_uid
-            #generated_owner_id = str(owner_first_name)[0] + str(owner_last_name)[0] + random_uid[0] + random_uid[1] + random_uid[2] + random_uid[3]
-            generated_owner_password = random_uid[4] + random_uid[5] + random_uid[6] + random_uid[7] + str(owner_first_name)[0] + str(owner_last_name)[0]
-            name = generate_random_username()
-            print('owner username: ' + name)
-            print('owner password: ' + generated_owner_password)
-            
-            owner = User(
-                account_id=generated_owner_id,
-                account_type="OWNER",
-                first_name=ownerDetails['firstName'],
-                last_name=ownerDetails['lastName'],
-                contact_number=ownerDetails['phoneNumber'],
-                email=ownerDetails['email'],
-                username=name
-            )
-            owner.set_password(generated_owner_password)
-            owner.save()
-            send_account_creation_email(owner, generated_owner_password)
-            
-            ##Log the event
-            registrationEvent = Event(
-                referenceid=generated_owner_id,
-                what="OWNER REGISTRATION",
-                who=generated_owner_id,
-                )
-            registrationEvent.save()
-            
-        try: ##try to find if application allready exist
-             owner = Application.objects.get(ejari_no=leaseApplicationDetails['contractNo'])
-        except Application.DoesNotExist: ##if doesn't exist create a new object
-            random_uid = str(uuid.uuid4().hex)
-            #generated_application_id = str(owner_first_name)[0] + str(tenant_first_name)[0] + \
-            #                           random_uid[0] + random_uid[1] + random_uid[2] + random_uid[3]
-            generated_application_id = random_uid
-            new_application = Application(
-                ejari_no=leaseApplicationDetails['contractNo'],
-                premis_no=leaseApplicationDetails['premiseNo'],
-                total_contract_value=leaseApplicationDetails['securityDepositAmount'],
-                address=leaseApplicationDetails['address'],
-                start_date=leaseApplicationDetails['contractStartDate'],
-                end_date=leaseApplicationDetails['contractEndDate'],
-                annual_rent=leaseApplicationDetails['annualRent'],
-                property_size=leaseApplicationDetails['propertySize'],
-                property_usage=leaseApplicationDetails['propertyUsage'],
-                currency_type=leaseApplicationDetails['currencyType'],
-                deposit_term=depositDetails['term'],
-                deposit_amount=depositDetails['amount'],
-                term_percent=depositDetails['termPercent'],
-                internal_id=generated_application_id,
-                tenant_id=generated_tenant_id,
-                owner_id=generated_owner_id
-            )
-            new_application.save()
-
-            ##Log the event
-            registrationEvent = Event(
-                     referenceid=generated_application_id,
-                     what="APPLICATION REGISTRATION",
-                     who=generated_tenant_id,
-                     )
-            registrationEvent.save()
-            send_application_confirm_email(tenant, owner, new_application)
-
-
-class FilterResource(ModelResource):
+    def post_list(self, request, **kwargs):
+        """
+        Registers a registrationForm: both parties are resolved with one email
+        lookup and the ejari number with one more, new users, application,
+        events and emails are written in bulk, all in one transaction. Responds
+        with the result and the number of queries it took.
+        """
+        data = self.deserialize(request, request.body, format=request.META.get('CONTENT_TYPE', 'application/json'))
+        try:
+            form = parse_registration_form(data['registrationForm'])
+        except (KeyError, TypeError):
+            raise BadRequest('missing registrationForm')
+        except RegistrationFormError as e:
+            raise BadRequest(str(e))
+
+        with count_queries() as queries:
+            result = BulkRegistration().register(form)
+        result['queries'] = queries.count
+        logger.info('registration %s took %s queries', result.get('internal_id', result['status']), queries.count)
+
+        return self.create_response(request, result,
+                                    http.HttpCreated if result['status'] == 'created' else http.HttpResponse)
+
+
+class FilterResource(MetricsMixin, ModelResource):
     class Meta:
         queryset = AppFilter.objects.all()
         resource_name = 'filters'
         authorization = Authorization()
-        authentication = ApiKeyAuthentication()
+        authentication = CachedApiKeyAuthentication()
 
     def obj_create(self, bundle, **kwargs):
         filter_set = bundle.data['filter_set']
         filter_name = bundle.data['filter_name']
-        print(filter_set)
         app_filter = AppFilter(
             filter_name=filter_name,
             filter_owner=bundle.request.user,
@@ -547,18 +873,70 @@ class FilterResource(ModelResource):
         app_filter.save()
         return app_filter
 
+    def prepend_urls(self):
+        return [
+            url(r'^(?P<resource_name>%s)/(?P<pk>\d+)/results%s$' % (self._meta.resource_name, trailing_slash()),
+                self.wrap_view('get_results'), name='api_filter_results'),
+        ]
+
     def get_object_list(self, request):
         return AppFilter.objects.filter(filter_owner=request.user)
 
+    def get_results(self, request, **kwargs):
+        """
+        Runs the saved filter in the database and returns the matching
+        applications in the /applications/ list format
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
 
-def generate_random_username(length=16, chars=ascii_letters + digits, split=4, delimiter='-'):
-    username = ''.join([choice(chars) for i in range(length)])
-
-    if split:
-        username = delimiter.join([username[start:start + split] for start in range(0, len(username), split)])
+        try:
+            app_filter = self.get_object_list(request).get(pk=kwargs['pk'])
+        except AppFilter.DoesNotExist:
+            return http.HttpNotFound()
 
-    try:
-        User.objects.get(username=username)
-        return generate_random_username(length=length, chars=chars, split=split, delimiter=delimiter)
-    except User.DoesNotExist:
-        return username
\ No newline at end of file
+        try:
+            objects = filter_results(app_filter).select_related('tenant_user', 'owner_user')
+        except ValueError as e:
+            raise BadRequest(str(e))
+
+        return ApplicationResource().create_list_response(request, objects, resource_uri=request.path)
+
+
+def not_modified(etag):
+    response = http.HttpNotModified()
+    response['ETag'] = etag
+    return response
+
+
+PARTY_COLUMNS = ('first_name', 'last_name', 'contact_number', 'email')
+PARTY_FIELDS = tuple('%s_%s' % (role, field) for role in ('tenant', 'owner')
+                     for field in ('name', 'first_name', 'last_name', 'phone_number', 'email'))
+
+
+def projected_party(row, role, resolver):
+    if row['%s_user_id' % role] is not None:
+        values = [row['%s_user__%s' % (role, column)] for column in PARTY_COLUMNS]
+    else:
+        user = resolver.get(row['%s_id' % role]) or User()
+        values = [getattr(user, column) for column in PARTY_COLUMNS]
+    first_name, last_name, contact_number, email = values
+    return {
+        'name': '%s %s' % (first_name, last_name),
+        'first_name': first_name,
+        'last_name': last_name,
+        'phone_number': contact_number,
+        'email': email,
+    }
+
+
+def add_party_fields(bundle, prefix, user):
+    if user is None:
+        user = User()
+    bundle.data[prefix + '_name'] = user.full_name
+    bundle.data[prefix + '_first_name'] = user.first_name
+    bundle.data[prefix + '_last_name'] = user.last_name
+    bundle.data[prefix + '_phone_number'] = user.contact_number
+    bundle.data[prefix + '_email'] = user.email
+    return bundle
@@ -1,3 +1,959 @@
-from django.test import TestCase
+import datetime
+import json
+import re
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import DatabaseError, connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.core.archive import archive_events
+from api.core.audit import AsyncAuditWriter, audit_events
+from api.core.authentication import api_key_cache
+from api.core.filters import compile_filter, materialize
+from api.core.helpers import queue_email
+from api.core.live import EventNotifier, account_events, event_stream
+from api.core.numbers import parse_decimal
+from api.core.outbox import drain_outbox
+from api.core import audit, confirmation, registration, search
+from api.core.registration import BulkRegistration
+from api.core.search import get_search_backend
+from api.core.summary import apply_delta
+from api.models import User, Application, Event, ArchivedEvent, AppFilter, AppFilterResult, OutboundEmail, \
+    UserApplicationSummary
+
+
+class FlakyEmailBackend(EmailBackend):
+    """
+    SMTP stand-in that counts opened connections and fails for listed recipients
+    """
+    opened = 0
+    failing = ()
+
+    def open(self):
+        FlakyEmailBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & set(self.failing):
+                raise ConnectionError('recipient refused')
+        return super(FlakyEmailBackend, self).send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='api.tests.FlakyEmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2,
+                   EMAIL_OUTBOX_RETRY_DELAY=0)
+class EmailOutboxTest(TestCase):
+    def setUp(self):
+        FlakyEmailBackend.opened = 0
+        FlakyEmailBackend.failing = ()
+
+    def test_batch_is_sent_over_one_connection(self):
+        for i in range(3):
+            queue_email('subject', 'body', ['user%s@example.com' % i])
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(drain_outbox(), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(FlakyEmailBackend.opened, 1)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists())
+
+    def test_failed_email_is_retried_then_dead_lettered(self):
+        FlakyEmailBackend.failing = ('bad@example.com', )
+        queue_email('subject', 'body', ['bad@example.com'])
+        queue_email('subject', 'body', ['good@example.com'])
+
+        self.assertEqual(drain_outbox(), (1, 1))
+        self.assertEqual(OutboundEmail.objects.get(to='bad@example.com').status, OutboundEmail.FAILED)
+
+        self.assertEqual(drain_outbox(), (0, 1))
+        email = OutboundEmail.objects.get(to='bad@example.com')
+        self.assertEqual(email.status, OutboundEmail.DEAD)
+        self.assertEqual(email.attempts, 2)
+        self.assertEqual(drain_outbox(), (0, 0))
+
+
+class ReplicaRoutingTest(TestCase):
+    """
+    default and replica are separate database files here, rows written to only
+    one of them show which database served a request
+    """
+    multi_db = True
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1')
+        self.auth = {'HTTP_AUTHORIZATION': 'ApiKey tenant:%s' % self.user.api_key.key}
+        for alias, ejari_no in (('default', 'PRIMARY'), ('replica', 'REPLICA')):
+            Application.objects.using(alias).bulk_create([Application(
+                ejari_no=ejari_no, internal_id=ejari_no, tenant_id='acc1', owner_id='acc2',
+                start_date=datetime.date(2019, 1, 1), end_date=datetime.date(2020, 1, 1))])
+            Event.objects.using(alias).bulk_create([Event(referenceid=ejari_no, what='CREATED', who='acc1')])
+
+    def get_list(self, path):
+        response = self.client.get(path, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))['objects']
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual([row['ejari_no'] for row in self.get_list('/api/v1/applications/')], ['REPLICA'])
+        self.assertEqual([row['referenceid'] for row in self.get_list('/api/v1/events/')], ['REPLICA'])
+
+    def save_filter(self):
+        filter_set = {'property_type': '', 'property_size': {'name': '', 'value': 0, 'from': 0, 'to': 0},
+                      'tenant_name': '', 'owner_name': '', 'start_date': '', 'end_date': '', 'address': ''}
+        response = self.client.post('/api/v1/filters/', json.dumps({'filter_name': 'all', 'filter_set': filter_set}),
+                                    content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 201)
+
+    def test_reads_after_a_write_are_pinned_to_default(self):
+        self.save_filter()
+        self.assertEqual([row['ejari_no'] for row in self.get_list('/api/v1/applications/')], ['PRIMARY'])
+        self.assertEqual([row['referenceid'] for row in self.get_list('/api/v1/events/')], ['PRIMARY'])
+
+    def test_pin_travels_with_the_client(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.save_filter()
+        self.assertFalse([query for query in queries.captured_queries if 'cache' in query['sql']])
+        self.assertIn('replica_pin', self.client.cookies)
+        self.client.cookies.clear()
+        self.assertEqual([row['ejari_no'] for row in self.get_list('/api/v1/applications/')], ['REPLICA'])
+
+    @override_settings(DATABASE_REPLICA_PIN_SECONDS=0)
+    def test_pin_expires(self):
+        self.save_filter()
+        self.assertEqual([row['ejari_no'] for row in self.get_list('/api/v1/applications/')], ['REPLICA'])
+
+
+## a plan step reading a whole table, "SCAN TABLE x" before SQLite 3.36
+TABLE_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$')
+
+HOT_QUERIES = (
+    ('confirmation by internal_id', lambda: Application.objects.filter(internal_id__in=['a', 'b'])),
+    ('registration dedupe by ejari_no', lambda: Application.objects.filter(ejari_no__in=['E1', 'E2'])),
+    ('applications of an account',
+     lambda: Application.objects.filter(Q(tenant_id='acc1') | Q(owner_id='acc1'))),
+    ('applications of an account by status',
+     lambda: Application.objects.filter(Q(tenant_id='acc1') | Q(owner_id='acc1'), status='NEW')),
+    ('applications list tenant_id filter', lambda: Application.objects.filter(tenant_id='acc1')),
+    ('events by who', lambda: Event.objects.filter(who='acc1').order_by('-pk')[:21]),
+    ('events by referenceid', lambda: Event.objects.filter(referenceid='a').order_by('-pk')[:21]),
+    ('events feed of an account', lambda: account_events('acc1').filter(pk__gt=0).order_by('pk')[:500]),
+    ('archived events by referenceid', lambda: ArchivedEvent.objects.filter(referenceid='a').order_by('-pk')[:21]),
+    ('parties by account_id', lambda: User.objects.filter(account_id__in=['acc1', 'acc2'])),
+    ('registration users by email', lambda: User.objects.filter(email__in=['a@example.com', 'b@example.com'])),
+    ('dashboard summary', lambda: UserApplicationSummary.objects.filter(account_id='acc1')),
+)
+
+
+class QueryPlanTest(TestCase):
+    """
+    EXPLAIN QUERY PLAN of the hot lookups, each has to be served by an index
+    """
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in HOT_QUERIES:
+            with self.subTest(name):
+                plan = self.query_plan(queryset())
+                self.assertFalse([step for step in plan if TABLE_SCAN.match(step)], plan)
+
+    def test_ejari_no_is_unique(self):
+        self.assertTrue(Application._meta.get_field('ejari_no').unique)
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, Application._meta.db_table)
+        self.assertTrue(any(index['unique'] and index['columns'] == ['ejari_no'] for index in indexes.values()))
+
+
+class ApplicationConfirmationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.tenant = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1')
+        self.owner = User.objects.create(username='owner', email='owner@example.com', account_id='acc2')
+        for number in ('I1', 'I2'):
+            Application.objects.create(ejari_no=number, internal_id=number, tenant_id='acc1', owner_id='acc2',
+                                       start_date=datetime.date(2019, 1, 1), end_date=datetime.date(2020, 1, 1))
+
+    def post(self, user, path, data):
+        response = self.client.post(path, json.dumps(data), content_type='application/json',
+                                    HTTP_AUTHORIZATION='ApiKey %s:%s' % (user.username, user.api_key.key))
+        return response, json.loads(response.content.decode('utf-8')) if response.content else None
+
+    def confirm(self, user, internal_id):
+        return self.post(user, '/api/v1/confirmApplication/', {'applicationID': internal_id, 'userID': user.account_id})
+
+    def test_parties_only_confirm_for_themselves(self):
+        response, data = self.post(self.tenant, '/api/v1/confirmApplication/',
+                                   {'applicationID': 'I1', 'userID': 'acc2'})
+        self.assertEqual(response.status_code, 403)
+        response, data = self.post(self.tenant, '/api/v1/confirmApplication/bulk/',
+                                   {'applicationIDs': ['I1', 'I2'], 'userID': 'acc2'})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Application.objects.filter(is_confirmed_by_owner='YES').exists())
+
+    def test_application_ids_must_be_strings(self):
+        for applicationIDs in ([['I1']], [1], ['I1', None]):
+            response, data = self.post(self.tenant, '/api/v1/confirmApplication/bulk/',
+                                       {'applicationIDs': applicationIDs, 'userID': 'acc1'})
+            self.assertEqual(response.status_code, 400)
+        response, data = self.post(self.tenant, '/api/v1/confirmApplication/',
+                                   {'applicationID': ['I1'], 'userID': 'acc1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Application.objects.filter(is_confirmed_by_tenant='YES').exists())
+
+    def test_admins_confirm_for_a_party(self):
+        admin = User.objects.create(username='admin', email='admin@example.com', account_id='acc3', is_admin=True)
+        response, data = self.post(admin, '/api/v1/confirmApplication/bulk/',
+                                   {'applicationIDs': ['I1'], 'userID': 'acc2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['objects'][0]['status'], 'confirmed')
+
+    def summary(self, user):
+        response = self.client.get('/api/v1/users/%s/summary/' % user.pk,
+                                   HTTP_AUTHORIZATION='ApiKey %s:%s' % (user.username, user.api_key.key))
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_second_confirmation_transitions_once(self):
+        response, data = self.confirm(self.tenant, 'I1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(data, {'status': 'confirmed', 'role': 'tenant', 'application_status': 'NEW',
+                                'transitioned': False})
+
+        response, data = self.confirm(self.owner, 'I1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(data, {'status': 'confirmed', 'role': 'owner', 'application_status': 'CONFIRMED',
+                                'transitioned': True})
+
+        for user, role in ((self.tenant, 'tenant'), (self.owner, 'owner')):
+            response, data = self.confirm(user, 'I1')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data, {'status': 'already_confirmed', 'role': role, 'application_status': 'CONFIRMED'})
+
+        self.assertEqual(Application.objects.get(internal_id='I1').status, 'CONFIRMED')
+        self.assertEqual(Event.objects.filter(referenceid='I1', what='APPLICATION CONFIRMATION').count(), 2)
+
+    def test_outcomes(self):
+        Application.objects.create(ejari_no='I3', internal_id='I3', tenant_id='acc3', owner_id='acc4',
+                                   start_date=datetime.date(2019, 1, 1), end_date=datetime.date(2020, 1, 1))
+        response, data = self.post(self.tenant, '/api/v1/confirmApplication/bulk/',
+                                   {'applicationIDs': ['I1', 'I3', 'missing'], 'userID': 'acc1'})
+        self.assertEqual([(result['applicationID'], result['status']) for result in data['objects']],
+                         [('I1', 'confirmed'), ('I3', 'not_a_party'), ('missing', 'not_found')])
+
+        response, data = self.post(self.tenant, '/api/v1/confirmApplication/bulk/',
+                                   {'applicationIDs': ['I1', 'I2'], 'userID': 'acc1'})
+        self.assertEqual([(result['applicationID'], result['status']) for result in data['objects']],
+                         [('I1', 'already_confirmed'), ('I2', 'confirmed')])
+
+        self.assertEqual(self.confirm(self.tenant, 'missing')[0].status_code, 404)
+        response, data = self.confirm(self.tenant, 'I3')
+        self.assertEqual((response.status_code, data['status']), (200, 'not_a_party'))
+
+    def test_concurrent_change_is_a_conflict(self):
+        change = confirmation.confirmation_change
+
+        def owner_confirms_meanwhile(values, account_id):
+            ## lands between the read and the UPDATE, as without row locks
+            Application.objects.filter(pk=values['pk']).update(is_confirmed_by_owner='YES')
+            return change(values, account_id)
+
+        with mock.patch.object(confirmation, 'confirmation_change', owner_confirms_meanwhile):
+            response, data = self.confirm(self.tenant, 'I1')
+        self.assertEqual((response.status_code, data), (409, {'status': 'conflict', 'role': 'tenant'}))
+        self.assertEqual(Application.objects.get(internal_id='I1').is_confirmed_by_tenant, 'NO')
+
+        response, data = self.confirm(self.tenant, 'I1')
+        self.assertEqual((response.status_code, data['application_status'], data['transitioned']),
+                         (201, 'CONFIRMED', True))
+
+    def test_summary_counters_follow_the_confirmations(self):
+        self.assertEqual(self.summary(self.tenant)['pending_confirmations'], 2)
+        self.confirm(self.tenant, 'I1')
+        self.confirm(self.owner, 'I1')
+        self.confirm(self.owner, 'I2')
+
+        tenant, owner = self.summary(self.tenant), self.summary(self.owner)
+        self.assertEqual((tenant['counts']['NEW'], tenant['counts']['CONFIRMED']), (1, 1))
+        self.assertEqual((owner['counts']['NEW'], owner['counts']['CONFIRMED']), (1, 1))
+        self.assertEqual(tenant['pending_confirmations'], 1)
+        self.assertEqual(owner['pending_confirmations'], 0)
+
+
+class ParseDecimalTest(TestCase):
+
+    def test_legacy_amounts(self):
+        self.assertEqual(str(parse_decimal('12,000.50')), '12000.50')
+        self.assertEqual(str(parse_decimal('AED 12000')), '12000.00')
+        self.assertEqual(str(parse_decimal('80 sqm')), '80.00')
+        self.assertIsNone(parse_decimal(' '))
+
+    def test_ambiguous_values_are_rejected(self):
+        for value in ('N/A', '10-20', '1.200,50', '12k', '1,2,3', '80sqm'):
+            with self.subTest(value):
+                self.assertRaises(ValueError, parse_decimal, value)
+
+    def test_max_digits(self):
+        self.assertEqual(str(parse_decimal('999999999999.99', max_digits=14)), '999999999999.99')
+        self.assertRaises(ValueError, parse_decimal, '123456789012345', max_digits=14)
+
+
+class MaterializedFilterRefreshTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1',
+                                        first_name='Sam', last_name='Tenant')
+        self.application = Application.objects.create(
+            ejari_no='E1', internal_id='I1', tenant_id='acc1', owner_id='acc2', address='1 Palm Street',
+            start_date=datetime.date(2019, 1, 1), end_date=datetime.date(2020, 1, 1))
+        self.filters = []
+
+    def add_filters(self, count):
+        for i in range(count):
+            app_filter = AppFilter.objects.create(filter_owner=self.user, address=('Palm', 'Creek')[i % 2],
+                                                  tenant_name='Sam' if i % 3 == 0 else '')
+            materialize(app_filter)
+            self.filters.append(app_filter)
+
+    def save_queries(self, **changes):
+        for name, value in changes.items():
+            setattr(self.application, name, value)
+        with CaptureQueriesContext(connection) as queries:
+            self.application.save()
+        return len(queries.captured_queries)
+
+    def assertResultsMatch(self):
+        for app_filter in self.filters:
+            self.assertEqual(
+                set(AppFilterResult.objects.filter(app_filter=app_filter).values_list('application_id', flat=True)),
+                set(Application.objects.filter(compile_filter(app_filter)).values_list('pk', flat=True)))
+
+    def test_queries_dont_grow_with_the_filters(self):
+        self.add_filters(2)
+        few = self.save_queries(address='2 Creek Road')
+        self.assertResultsMatch()
+        self.add_filters(28)
+        self.assertEqual(self.save_queries(address='3 Palm Street'), few)
+        self.assertResultsMatch()
+
+    def test_saves_not_changing_filter_columns_skip_the_refresh(self):
+        self.add_filters(3)
+        self.save_queries()
+        with CaptureQueriesContext(connection) as queries:
+            self.application.save()
+        self.assertFalse([query for query in queries.captured_queries if 'api_appfilter' in query['sql']])
+
+    def test_renames_refresh_the_user_applications(self):
+        self.add_filters(3)
+        materialized = dict(AppFilter.objects.values_list('pk', 'materialized_at'))
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        self.assertFalse([query for query in queries.captured_queries if 'api_appfilter' in query['sql']])
+
+        user.first_name = 'Alex'
+        user.save()
+        self.assertResultsMatch()
+        self.assertFalse(AppFilterResult.objects.filter(app_filter__tenant_name='Sam').exists())
+        self.assertEqual(dict(AppFilter.objects.values_list('pk', 'materialized_at')), materialized)
+
+
+class SummaryDeltaTest(TestCase):
+
+    def counts(self):
+        return dict(((row.account_id, row.status), row.count) for row in UserApplicationSummary.objects.all())
+
+    def test_counters_are_created_and_incremented(self):
+        apply_delta({('acc1', 'PENDING'): 2, ('acc2', 'PENDING'): 1, ('acc3', 'PENDING'): 0})
+        apply_delta({('acc1', 'PENDING'): -1, ('acc1', 'CONFIRMED'): 1, ('acc2', 'PENDING'): 3})
+        self.assertEqual(self.counts(), {('acc1', 'PENDING'): 1, ('acc1', 'CONFIRMED'): 1, ('acc2', 'PENDING'): 4})
+
+    def test_queries_dont_grow_with_the_accounts(self):
+        delta = dict((('acc%s' % i, 'PENDING'), 1) for i in range(40))
+        apply_delta(dict(list(delta.items())[:20]))
+        with CaptureQueriesContext(connection) as queries:
+            apply_delta(delta)
+        self.assertLessEqual(len([query for query in queries.captured_queries
+                                  if 'api_userapplicationsummary' in query['sql']]), 3)
+        self.assertEqual(self.counts(), dict((key, 2 if i < 20 else 1) for i, key in enumerate(delta)))
+
+
+class AuditSinkTest(TestCase):
+
+    def setUp(self):
+        Event.objects.all().delete()
+
+    def inserts(self, queries):
+        return [query for query in queries.captured_queries if query['sql'].startswith('INSERT INTO "api_event"')]
+
+    @override_settings(AUDIT_ASYNC_EVENTS=False)
+    def test_buffered_events_are_written_at_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            with audit_events() as sink:
+                for what in ('CREATED', 'CONFIRMED'):
+                    sink.record('I1', what, 'acc1')
+                sink.record('I1', 'VIEWED', 'acc1', critical=False)
+                self.assertFalse(self.inserts(queries))
+        self.assertEqual(len(self.inserts(queries)), 1)
+        self.assertEqual(sorted(Event.objects.values_list('what', flat=True)), ['CONFIRMED', 'CREATED', 'VIEWED'])
+
+    @override_settings(AUDIT_ASYNC_EVENTS=True)
+    def test_non_critical_events_go_to_the_writer(self):
+        writer = AsyncAuditWriter(max_queue=10)
+        with mock.patch.object(audit, 'get_async_writer', return_value=writer), \
+                mock.patch.object(audit.transaction, 'on_commit', side_effect=lambda callback: callback()):
+            with audit_events() as sink:
+                sink.record('I1', 'CONFIRMED', 'acc1')
+                sink.record('I1', 'VIEWED', 'acc1', critical=False)
+        self.assertEqual(list(Event.objects.values_list('what', flat=True)), ['CONFIRMED'])
+        self.assertEqual([event.what for event in writer.queue.queue], ['VIEWED'])
+
+    def test_full_writer_queue_writes_synchronously(self):
+        writer = AsyncAuditWriter(max_queue=1)
+        writer.submit([Event(referenceid='I1', what=what, who='acc1') for what in ('CREATED', 'CONFIRMED', 'VIEWED')])
+        self.assertEqual([event.what for event in writer.queue.queue], ['CREATED'])
+        self.assertEqual(sorted(Event.objects.values_list('what', flat=True)), ['CONFIRMED', 'VIEWED'])
+
+
+class BulkRegistrationTest(TestCase):
+
+    def form(self, contract_no, first_name='Sam', **details):
+        lease = {'contractNo': contract_no, 'premiseNo': 'P1', 'securityDepositAmount': '5,000',
+                 'address': '1 Palm Street', 'contractStartDate': '2019-01-01', 'contractEndDate': '2020-01-01',
+                 'annualRent': '60000', 'propertySize': '80 sqm', 'propertyUsage': 'Residential',
+                 'currencyType': 'AED'}
+        lease.update(details)
+        party = {'firstName': first_name, 'lastName': 'Tenant', 'phoneNumber': '1',
+                 'email': 'tenant@example.com'}
+        return json.dumps({'registrationForm': {
+            'leaseApplicationDetails': lease,
+            'depositDetails': {'term': '12', 'amount': '5000', 'termPercent': '10'},
+            'personalDetails': party,
+            'otherParty': {'firstName': 'Olly', 'lastName': 'Owner', 'phoneNumber': '2',
+                           'email': 'owner@example.com'},
+        }})
+
+    def test_invalid_lines_are_reported_per_line(self):
+        results = list(BulkRegistration().run([
+            self.form('E1'),
+            self.form('E2', contractEndDate='2019-02-30'),
+            self.form('E3', first_name=''),
+            self.form('E4'),
+        ]))
+        self.assertEqual([result['line'] for result in results], [1, 2, 3, 4])
+        self.assertEqual([result['status'] for result in results], ['created', 'error', 'error', 'created'])
+        self.assertIn('end_date', results[1]['error'])
+        self.assertIn('firstName', results[2]['error'])
+        self.assertEqual(set(Application.objects.values_list('ejari_no', flat=True)), {'E1', 'E4'})
+
+    def test_passwords_are_hashed_before_the_transaction(self):
+        depths = []
+
+        def hash_passwords(credentials):
+            depths.append(len(connection.savepoint_ids))
+            return ['!'] * len(credentials)
+
+        depth = len(connection.savepoint_ids)
+        with mock.patch.object(registration, 'hash_passwords', hash_passwords):
+            results = list(BulkRegistration().run([self.form('E1'), self.form('E2')]))
+        self.assertEqual([result['status'] for result in results], ['created', 'created'])
+        self.assertEqual(depths, [depth])
+        self.assertEqual(User.objects.filter(password='!').count(), 2)
+
+    def register(self, contract_no):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/v1/registerApplication/', self.form(contract_no),
+                                        content_type='application/json')
+        return response.status_code, json.loads(response.content.decode('utf-8')), len(queries)
+
+    def test_registration_reports_its_queries(self):
+        status, result, first_queries = self.register('E1')
+        self.assertEqual((status, result['status']), (201, 'created'))
+        self.assertEqual(result['queries'], first_queries)
+
+        ## the parties exist now, no users to create
+        status, result, queries = self.register('E2')
+        self.assertEqual((status, result['status']), (201, 'created'))
+        self.assertEqual(result['queries'], queries)
+        self.assertLess(queries, first_queries)
+        self.assertEqual(set(Application.objects.values_list('tenant_id', flat=True)), {result['tenant_id']})
+
+        status, result, queries = self.register('E2')
+        self.assertEqual((status, result['status']), (200, 'exists'))
+
+    def test_failed_registration_leaves_nothing(self):
+        Event.objects.all().delete()
+        form = registration.parse_registration_line(self.form('E1'))
+        with mock.patch.object(OutboundEmail.objects, 'bulk_create', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                BulkRegistration().register(form)
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Application.objects.exists())
+        self.assertFalse(Event.objects.exists())
+        self.assertEqual(get_search_backend().search('palm', 10), [])
+
+
+class ApplicationPartiesTest(TestCase):
+
+    def setUp(self):
+        self.tenant = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1')
+        self.other = User.objects.create(username='other', email='other@example.com', account_id='acc3')
+        self.owner = User.objects.create(username='owner', email='owner@example.com', account_id='acc2')
+
+    def create(self, **parties):
+        return Application.objects.create(ejari_no='E1', internal_id='I1', start_date=datetime.date(2019, 1, 1),
+                                          end_date=datetime.date(2020, 1, 1), **parties)
+
+    def test_relations_follow_the_account_ids(self):
+        application = self.create(tenant_id='acc1', owner_id='acc2')
+        self.assertEqual((application.tenant_user, application.owner_user), (self.tenant, self.owner))
+
+        application = Application.objects.get(pk=application.pk)
+        application.tenant_id = 'acc3'
+        application.save(update_fields=['tenant_id'])
+        application = Application.objects.get(pk=application.pk)
+        self.assertEqual((application.tenant_user, application.owner_user), (self.other, self.owner))
+
+        application.tenant_id = 'unknown'
+        application.save()
+        self.assertIsNone(Application.objects.get(pk=application.pk).tenant_user)
+
+    def test_account_ids_follow_the_relations(self):
+        application = self.create(tenant_user=self.tenant, owner_user=self.owner)
+        self.assertEqual((application.tenant_id, application.owner_id), ('acc1', 'acc2'))
+
+
+@override_settings(DATABASE_REPLICA=None)
+class ApplicationListTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1',
+                                        first_name='Sam', last_name='Tenant')
+        self.auth = {'HTTP_AUTHORIZATION': 'ApiKey tenant:%s' % self.user.api_key.key}
+        User.objects.create(username='owner', email='owner@example.com', account_id='acc2', first_name='Olive',
+                            last_name='Owner')
+        ## bulk_create leaves tenant_user/owner_user unset like rows written before the relations existed
+        Application.objects.bulk_create([Application(
+            ejari_no='E%s' % i, internal_id='I%s' % i, tenant_id='acc1', owner_id='acc2', address='%s Creek Road' % i,
+            annual_rent=1000 * i, start_date=datetime.date(2019, 1, 1), end_date=datetime.date(2020, 1, 1))
+            for i in range(20)])
+
+    def get(self, path):
+        api_key_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, **self.auth)
+        return response.status_code, json.loads(response.content.decode('utf-8')), len(queries)
+
+    def test_queries_dont_grow_with_the_page(self):
+        status, data, small_page = self.get('/api/v1/applications/?limit=2')
+        self.assertEqual((status, len(data['objects'])), (200, 2))
+        status, data, large_page = self.get('/api/v1/applications/?limit=20')
+        self.assertEqual((status, len(data['objects'])), (200, 20))
+        self.assertEqual(large_page, small_page)
+        self.assertEqual(set((row['tenant_name'], row['owner_email']) for row in data['objects']),
+                         set([('Sam Tenant', 'owner@example.com')]))
+
+    def test_sparse_fieldsets(self):
+        status, data, queries = self.get('/api/v1/applications/?fields=ejari_no,annual_rent,tenant_name'
+                                         '&order_by=annual_rent&limit=2')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['objects'], [
+            {'ejari_no': 'E0', 'annual_rent': '0', 'tenant_name': 'Sam Tenant'},
+            {'ejari_no': 'E1', 'annual_rent': '1000', 'tenant_name': 'Sam Tenant'},
+        ])
+        self.assertEqual(data['meta']['total_count'], 20)
+
+        ## the projection renders the fields the same way as the full bundles
+        status, full, queries = self.get('/api/v1/applications/?order_by=annual_rent&limit=2')
+        self.assertEqual([dict((name, row[name]) for name in ('ejari_no', 'annual_rent', 'tenant_name'))
+                          for row in full['objects']], data['objects'])
+
+    def test_unknown_fields_are_rejected(self):
+        status, data, queries = self.get('/api/v1/applications/?fields=ejari_no,password,tenant_salary')
+        self.assertEqual(status, 400)
+        self.assertIn('password, tenant_salary', data['error'])
+
+    def export(self, query):
+        response = self.client.get('/api/v1/applications/export/?%s' % query, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    @override_settings(EXPORT_CHUNK_SIZE=3)
+    def test_exports_match_the_list(self):
+        status, data, queries = self.get('/api/v1/applications/?annual_rent__gte=12000&limit=0')
+        listed = [(row['ejari_no'], row['annual_rent'], row['owner_name']) for row in data['objects']]
+        self.assertEqual(len(listed), 8)
+
+        lines = self.export('annual_rent__gte=12000&fields=ejari_no,annual_rent,owner_name').splitlines()
+        self.assertEqual(lines[0], 'ejari_no,annual_rent,owner_name')
+        self.assertEqual(sorted(tuple(line.split(',')) for line in lines[1:]), sorted(listed))
+
+        rows = [json.loads(line) for line in self.export('annual_rent__gte=12000&format=ndjson').splitlines()]
+        self.assertEqual(sorted((row['ejari_no'], row['annual_rent'], row['owner_name']) for row in rows),
+                         sorted(listed))
+        ## every field of the list is exported when none are selected
+        self.assertEqual(set(rows[0]), set(data['objects'][0]) - set(['resource_uri']))
+
+    def test_unsupported_export_format(self):
+        response = self.client.get('/api/v1/applications/export/?format=xml', **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(DATABASE_REPLICA=None)
+class EventPaginationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1')
+        self.auth = {'HTTP_AUTHORIZATION': 'ApiKey tenant:%s' % self.user.api_key.key}
+        Event.objects.all().delete()
+        Event.objects.bulk_create([Event(referenceid='I%s' % i, what='CREATED', who='acc1') for i in range(25)])
+        self.ids = list(Event.objects.order_by('-pk').values_list('pk', flat=True))
+
+    def get(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, **self.auth)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'COUNT(' in query['sql'] or 'OFFSET' in query['sql']])
+        return response.status_code, json.loads(response.content.decode('utf-8'))
+
+    def test_walks_older_and_newer_pages(self):
+        pages = []
+        path = '/api/v1/events/?limit=10'
+        while path:
+            status, data = self.get(path)
+            self.assertEqual(status, 200)
+            pages.append([row['id'] for row in data['objects']])
+            path = data['meta']['next']
+        self.assertEqual(pages, [self.ids[:10], self.ids[10:20], self.ids[20:]])
+
+        status, data = self.get('/api/v1/events/?limit=10&before=%s' % self.ids[20])
+        self.assertEqual([row['id'] for row in data['objects']], self.ids[10:20])
+        status, data = self.get(data['meta']['previous'])
+        self.assertEqual([row['id'] for row in data['objects']], self.ids[:10])
+        self.assertIsNone(data['meta']['previous'])
+
+    def test_invalid_cursors(self):
+        self.assertEqual(self.get('/api/v1/events/?after=abc')[0], 400)
+        self.assertEqual(self.get('/api/v1/events/?after=1&before=2')[0], 400)
+        self.assertEqual(self.get('/api/v1/events/?limit=1000')[1]['meta']['limit'], 100)
+
+
+@override_settings(DATABASE_REPLICA=None, EVENT_ARCHIVE_AFTER_DAYS=90, EVENT_ARCHIVE_TERMINAL_AFTER_DAYS=1)
+class EventArchiveTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1')
+        self.auth = {'HTTP_AUTHORIZATION': 'ApiKey tenant:%s' % self.user.api_key.key}
+        Event.objects.all().delete()
+        now = timezone.now()
+        self.events = {}
+        for name, referenceid, status, age in (('old', 'I1', 'NEW', 100), ('handled', 'I1', 'HANDLED', 2),
+                                               ('recent', 'I1', 'NEW', 2), ('ignored', 'I1', 'IGNORED', 0),
+                                               ('other', 'I2', 'NEW', 100), ('new', 'I1', 'NEW', 0)):
+            event = Event.objects.create(referenceid=referenceid, what='CREATED', who='acc1', status=status)
+            Event.objects.filter(pk=event.pk).update(when=now - datetime.timedelta(days=age))
+            self.events[name] = Event.objects.get(pk=event.pk)
+
+    def ids(self, *names):
+        return [self.events[name].pk for name in names]
+
+    def test_archives_in_chunks(self):
+        self.assertEqual([archived for last_id, archived in archive_events(chunk_size=2)], [2, 1])
+        self.assertEqual(sorted(Event.objects.values_list('pk', flat=True)), self.ids('recent', 'ignored', 'new'))
+        self.assertEqual(sorted(ArchivedEvent.objects.values_list('pk', flat=True)),
+                         self.ids('old', 'handled', 'other'))
+        archived = ArchivedEvent.objects.get(pk=self.events['handled'].pk)
+        self.assertEqual((archived.status, archived.referenceid, archived.when),
+                         ('HANDLED', 'I1', self.events['handled'].when))
+        self.assertEqual(list(archive_events(chunk_size=2)), [])
+
+    def test_history_pages_through_both_tables(self):
+        list(archive_events())
+        pages = []
+        path = '/api/v1/events/history/I1/?limit=2'
+        while path:
+            response = self.client.get(path, **self.auth)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.content.decode('utf-8'))
+            pages.append([(row['id'], row['archived'], row['resource_uri'] is None) for row in data['objects']])
+            path = data['meta']['next']
+        new, ignored, recent, handled, old = self.ids('new', 'ignored', 'recent', 'handled', 'old')
+        self.assertEqual(pages, [[(new, False, False), (ignored, False, False)],
+                                 [(recent, False, False), (handled, True, True)],
+                                 [(old, True, True)]])
+
+
+@override_settings(DATABASE_REPLICA=None)
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1',
+                                        first_name='Sam')
+        self.auth = {'HTTP_AUTHORIZATION': 'ApiKey tenant:%s' % self.user.api_key.key}
+        self.application = Application.objects.create(
+            ejari_no='E1', internal_id='I1', tenant_id='acc1', owner_id='acc2',
+            start_date=datetime.date(2019, 1, 1), end_date=datetime.date(2020, 1, 1))
+
+    def assertRevalidates(self, path, change):
+        response = self.client.get(path, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual((response.status_code, response['ETag']), (304, etag))
+        self.assertFalse(response.content)
+        ## answered before the parties of any bundle are looked up
+        self.assertFalse([query for query in queries.captured_queries if '"api_user"' in query['sql']])
+
+        change()
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def save_application(self):
+        self.application.address = '2 Creek Road'
+        self.application.save()
+
+    def rename_tenant(self):
+        self.user.first_name = 'Samantha'
+        self.user.save()
+
+    def test_list(self):
+        self.assertRevalidates('/api/v1/applications/', self.save_application)
+        self.assertRevalidates('/api/v1/applications/', self.rename_tenant)
+        self.assertRevalidates('/api/v1/applications/', lambda: Application.objects.filter(pk=self.application.pk)
+                               .delete())
+
+    def test_detail(self):
+        path = '/api/v1/application-detail/%s/' % self.application.pk
+        self.assertRevalidates(path, self.save_application)
+        self.assertRevalidates(path, self.rename_tenant)
+
+
+@override_settings(DATABASE_REPLICA=None)
+class ApiKeyCacheTest(TestCase):
+
+    def setUp(self):
+        api_key_cache.clear()
+        self.user = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1')
+        self.key = self.user.api_key.key
+
+    def status(self, key=None):
+        response = self.client.get('/api/v1/events/', HTTP_AUTHORIZATION='ApiKey tenant:%s' % (key or self.key))
+        return response.status_code
+
+    def test_repeated_requests_skip_the_lookup(self):
+        self.assertEqual(self.status(), 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.status(), 200)
+        self.assertFalse([query for query in queries.captured_queries if 'tastypie_apikey' in query['sql']])
+
+    def test_regenerated_key(self):
+        self.assertEqual(self.status(), 200)
+        api_key = self.user.api_key
+        api_key.key = api_key.generate_key()
+        api_key.save()
+        self.assertEqual(self.status(), 401)
+        self.assertEqual(self.status(api_key.key), 200)
+
+    def test_deleted_key(self):
+        self.assertEqual(self.status(), 200)
+        self.user.api_key.delete()
+        self.assertEqual(self.status(), 401)
+
+    def test_deactivated_user(self):
+        self.assertEqual(self.status(), 200)
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(self.status(), 401)
+
+    def test_unrelated_saves_keep_the_entry(self):
+        self.assertEqual(self.status(), 200)
+        invalidations = api_key_cache.stats()['invalidations']
+        self.user.first_name = 'Sam'
+        self.user.save(update_fields=['first_name'])
+        self.assertEqual(api_key_cache.stats()['invalidations'], invalidations)
+        self.assertEqual(self.status(), 200)
+
+
+class MetricsAccessTest(TestCase):
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_without_a_token_only_in_debug(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'blockrent_api_key_cache_size', response.content)
+
+
+class SearchIndexTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1',
+                                        first_name='Sam', last_name='Tenant')
+        self.application = Application.objects.create(
+            ejari_no='E1', internal_id='I1', tenant_id='acc1', owner_id='acc2', address='1 Palm Street',
+            start_date=datetime.date(2019, 1, 1), end_date=datetime.date(2020, 1, 1))
+        self.auth = {'HTTP_AUTHORIZATION': 'ApiKey tenant:%s' % self.user.api_key.key}
+
+    def create(self, ejari_no, address, tenant_id='acc2'):
+        return Application.objects.create(
+            ejari_no=ejari_no, internal_id=ejari_no, tenant_id=tenant_id, owner_id='acc2', address=address,
+            start_date=datetime.date(2019, 1, 1), end_date=datetime.date(2020, 1, 1))
+
+    def search(self, query):
+        response = self.client.get('/api/v1/applications/search/', {'q': query}, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return [row['ejari_no'] for row in json.loads(response.content.decode('utf-8'))['objects']]
+
+    def test_results_are_ranked(self):
+        self.create('E2', 'Palm Palm Tower')
+        self.create('E3', '3 Creek Road', tenant_id='acc1')
+        self.assertEqual(self.search('palm'), ['E2', 'E1'])
+        self.assertEqual(self.search('pal'), ['E2', 'E1'])
+        self.assertEqual(self.search('creek sam'), ['E3'])
+        self.assertEqual(self.search('e3'), ['E3'])
+        self.assertEqual(self.search(''), [])
+
+    def test_index_follows_the_saves(self):
+        self.application.address = '2 Creek Road'
+        self.application.save()
+        self.assertEqual((self.search('palm'), self.search('creek')), ([], ['E1']))
+
+        self.user.last_name = 'Renter'
+        self.user.save()
+        self.assertEqual((self.search('tenant'), self.search('sam renter')), ([], ['E1']))
+
+        self.application.delete()
+        self.assertEqual(self.search('creek'), [])
+
+    def index_queries(self, save):
+        with CaptureQueriesContext(connection) as queries:
+            save()
+        return [query for query in queries.captured_queries if 'api_application_search' in query['sql']]
+
+    def test_saves_not_changing_indexed_columns_skip_the_index(self):
+        self.application.status = 'CONFIRMED'
+        self.assertFalse(self.index_queries(lambda: self.application.save(update_fields=['status'])))
+        self.assertFalse(self.index_queries(self.application.save))
+        self.application.address = '2 Creek Road'
+        self.assertTrue(self.index_queries(self.application.save))
+
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        self.assertFalse(self.index_queries(user.save))
+        user.last_name = 'Renter'
+        self.assertTrue(self.index_queries(user.save))
+
+    @override_settings(APPLICATION_SEARCH_BACKEND=None)
+    def test_backend_follows_the_database(self):
+        try:
+            search._backend = None
+            self.assertIsInstance(get_search_backend(), search.SQLiteFTSBackend)
+            search._backend = None
+            with mock.patch.object(search, 'connection', mock.Mock(vendor='postgresql')):
+                self.assertIsInstance(get_search_backend(), search.DatabaseSearchBackend)
+        finally:
+            search._backend = None
+
+
+class EventStreamTest(TestCase):
+
+    def setUp(self):
+        self.notifier = EventNotifier()
+        ## no poll thread, the tests poll themselves
+        self.notifier.thread = threading.current_thread()
+        Event.objects.all().delete()
+
+    def stream(self, account_id, last_id=None):
+        ## the referenceid of every event sent
+        return [json.loads(message.split('data: ', 1)[1]) for message in
+                event_stream(self.notifier, account_id, last_id, lambda row: row['referenceid'])
+                if 'data: ' in message]
+
+    @override_settings(EVENT_STREAM_MAX_DURATION=0)
+    def test_events_polled_while_subscribing_are_sent(self):
+        Event.objects.create(referenceid='old', what='CREATED', who='acc1')
+        subscribe = self.notifier.subscribe
+
+        def subscribe_then_poll(account_id):
+            subscription = subscribe(account_id)
+            Event.objects.create(referenceid='new', what='CREATED', who='acc1')
+            self.notifier.poll()
+            return subscription
+
+        self.notifier.subscribe = subscribe_then_poll
+        self.assertEqual(self.stream('acc1'), ['new'])
+
+    def event(self, referenceid, who):
+        return Event.objects.create(referenceid=referenceid, what='CREATED', who=who)
+
+    @override_settings(EVENT_STREAM_MAX_DURATION=0)
+    def test_backlog_of_the_followed_events(self):
+        Application.objects.create(ejari_no='E1', internal_id='I1', tenant_id='acc1', owner_id='acc2',
+                                   start_date=datetime.date(2019, 1, 1), end_date=datetime.date(2020, 1, 1))
+        first = self.event('own', 'acc1')
+        self.event('acc1', 'acc2')
+        self.event('I1', 'acc2')
+        self.event('I2', 'acc2')
+
+        self.assertEqual(self.stream('acc1', 0), ['own', 'acc1', 'I1'])
+        self.assertEqual(self.stream('acc1', first.pk), ['acc1', 'I1'])
+        self.assertEqual(self.stream('acc2', 0), ['acc1', 'I1', 'I2'])
+        ## without a last id only the events written after subscribing are sent
+        self.assertEqual(self.stream('acc1'), [])
+
+    @override_settings(EVENT_STREAM_MAX_DURATION=0, DATABASE_REPLICA=None)
+    def test_resumes_after_the_last_event_id(self):
+        user = User.objects.create(username='tenant', email='tenant@example.com', account_id='acc1')
+        auth = {'HTTP_AUTHORIZATION': 'ApiKey tenant:%s' % user.api_key.key}
+        first = self.event('one', 'acc1')
+        second = self.event('two', 'acc1')
+
+        with mock.patch('api.resources.get_notifier', return_value=self.notifier):
+            response = self.client.get('/api/v1/events/stream/', HTTP_LAST_EVENT_ID=str(first.pk), **auth)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            content = b''.join(response.streaming_content).decode('utf-8')
+            self.assertIn('id: %s\n' % second.pk, content)
+            self.assertNotIn('id: %s\n' % first.pk, content)
+
+            response = self.client.get('/api/v1/events/stream/', HTTP_LAST_EVENT_ID='abc', **auth)
+            self.assertEqual(response.status_code, 400)
+
+    def test_live_events_reach_their_followers(self):
+        tenant = self.notifier.subscribe('acc1')
+        owner = self.notifier.subscribe('acc2')
+        self.event('one', 'acc1')
+        self.event('two', 'acc2')
+        self.event('acc1', 'acc3')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.notifier.poll()
+        ## one read of the events, one of their users and one of their applications
+        self.assertEqual(len(queries), 3)
+        self.assertEqual([row['referenceid'] for row in list(tenant.queue.queue)], ['one', 'acc1'])
+        self.assertEqual([row['referenceid'] for row in list(owner.queue.queue)], ['two'])
@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
 from django.utils.encoding import force_text
 from django.utils.http import urlsafe_base64_encode
 from django.contrib.auth import login
+from api.core.metrics import request_metrics
 from api.models import User
 from api.tokens import account_activation_token
 
@@ -22,3 +25,17 @@ def activate(request, uidb64, token):
         return HttpResponse('Thank you for your email confirmation.')
     else:
         return HttpResponse('Activation link is invalid!')
+
+
+def metrics(request):
+    """
+    Request and api key cache metrics of this process in the Prometheus text
+    format, behind ``Authorization: Bearer <METRICS_TOKEN>``. Without a token
+    it's only served in DEBUG.
+    """
+    if not settings.METRICS_TOKEN:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer %s' % settings.METRICS_TOKEN):
+        return HttpResponseForbidden()
+    return HttpResponse(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.core.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,7 +51,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'corsheaders.middleware.CorsMiddleware'
+    'corsheaders.middleware.CorsMiddleware',
+    'api.core.routing.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'blockrent_django.urls'
@@ -79,10 +81,38 @@ WSGI_APPLICATION = 'blockrent_django.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'api.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'TEST': {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')},
+    },
+    # read only copy of default, a read only connection to the same file unless
+    # DATABASE_REPLICA_NAME points elsewhere
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DATABASE_REPLICA_NAME', 'file:%s?mode=ro' % os.path.join(BASE_DIR, 'db.sqlite3')),
+        'TEST': {'NAME': os.path.join(BASE_DIR, 'test_replica.sqlite3')},
+    },
 }
+
+# Applied to every new connection of the api.backends.sqlite3 engine, which also
+# starts transactions with BEGIN IMMEDIATE. `manage.py benchmark_sqlite`
+# compares it with the stock engine.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
+# tastypie list/detail reads go to DATABASE_REPLICA, a user's reads stay on
+# default for DATABASE_REPLICA_PIN_SECONDS after they wrote something. Every
+# process serving the api has to see the pin, so it's a signed cookie
+# (api.core.routing.PIN_COOKIE) rather than a cache entry. Clients that drop
+# cookies read from the replica right after their writes.
+DATABASE_ROUTERS = ['api.core.routing.ReplicaRouter']
+DATABASE_REPLICA = 'replica'
+DATABASE_REPLICA_PIN_SECONDS = 5
 #DATABASES = {
 #    'default': {
 #        'ENGINE': 'django.db.backends.postgresql_psycopg2',
@@ -139,8 +169,80 @@ CORS_ALLOW_CREDENTIALS = True
 
 AUTH_USER_MODEL = 'api.User'
 
-EMAIL_HOST = 'smtp.gmail.com'
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
 EMAIL_HOST_USER = os.environ.get('EMAIL_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_USER_PASSWORD')
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '1') == '1'
+
+# Transactional emails are written to the OutboundEmail outbox and delivered by
+# `manage.py process_email_outbox --loop`. For a local SMTP stand-in run
+# `python -m smtpd -n -c DebuggingServer localhost:1025` with
+# EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_USE_TLS=0.
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_DELAY = 60
+
+# Audit events recorded as non-critical are written by a background thread in
+# batches of AUDIT_ASYNC_BATCH_SIZE instead of with the request's transaction.
+AUDIT_ASYNC_EVENTS = False
+AUDIT_ASYNC_BATCH_SIZE = 200
+
+# Application search index. None picks the backend of the default database:
+# api.core.search.SQLiteFTSBackend on SQLite, where migration 0009 creates its
+# FTS5 table, and api.core.search.DatabaseSearchBackend, which works without an
+# index, everywhere else.
+APPLICATION_SEARCH_BACKEND = None
+
+# In process cache of authenticated (username, api key) pairs
+API_KEY_CACHE_SIZE = 1024
+API_KEY_CACHE_TTL = 60
+
+# Generated registration passwords are hashed in a pool of
+# PASSWORD_HASHING_WORKERS processes (0 hashes them on the request thread) with
+# the PBKDF2 iterations of the account type, Django upgrades them to the
+# default cost on the user's first login. `manage.py benchmark_registration`
+# measures the effect.
+PASSWORD_HASHING_WORKERS = 2
+GENERATED_PASSWORD_ITERATIONS = {
+    'TENANT': 30000,
+    'OWNER': 30000,
+}
+
+# Number of registrationForm lines written per transaction by registerApplication/bulk/
+BULK_REGISTRATION_CHUNK_SIZE = 200
+
+# events/stream/ live feed: new events are read by one thread per process every
+# EVENT_STREAM_POLL_INTERVAL seconds (immediately for events written by this
+# process) and fanned out to the open streams.
+EVENT_STREAM_POLL_INTERVAL = 2
+EVENT_STREAM_KEEPALIVE = 15
+EVENT_STREAM_MAX_DURATION = 300
+EVENT_STREAM_RETRY_MS = 3000
+EVENT_STREAM_QUEUE_SIZE = 1000
+
+# `manage.py archive_events` moves events older than EVENT_ARCHIVE_AFTER_DAYS,
+# and HANDLED/IGNORED ones older than EVENT_ARCHIVE_TERMINAL_AFTER_DAYS, to the
+# ArchivedEvent table. events/history/<referenceid>/ reads both tables.
+EVENT_ARCHIVE_AFTER_DAYS = 90
+EVENT_ARCHIVE_TERMINAL_AFTER_DAYS = 1
+
+# Per resource/view/method request metrics, served in the Prometheus text
+# format on /metrics to scrapers sending `Authorization: Bearer <METRICS_TOKEN>`,
+# without METRICS_TOKEN /metrics is only served in DEBUG. Every process keeps
+# its own, scrape the processes individually. A list request is counted as N+1 when it took a query per
+# object more than the smallest page of the endpoint, for pages at least
+# METRICS_N_PLUS_ONE_MIN_GROWTH objects larger.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_N_PLUS_ONE_MIN_GROWTH = 5
+
+# Latency, query and memory limits per scenario of `manage.py benchmark_api`
+# and the volumes, requests per scenario and scenarios they were measured with,
+# `--update-thresholds` rewrites them.
+BENCHMARK_THRESHOLDS = os.path.join(BASE_DIR, 'benchmark_thresholds.json')
+
+# Largest list of applicationIDs accepted by confirmApplication/bulk/
+BULK_CONFIRMATION_MAX_IDS = 1000
+
+# Rows read per query by the streaming applications/export/ and events/export/ endpoints
+EXPORT_CHUNK_SIZE = 1000
@@ -25,7 +25,7 @@ from django.contrib import admin
 from tastypie.api import Api
 from api.resources import UserResource, ApplicationResource, EventResource, RegistrationResource, \
     ApplicationConfirmResource, FilterResource, ApplicationDetailResource
-from api.views import activate
+from api.views import activate, metrics
 
 v1_api = Api(api_name='v1')
 v1_api.register(UserResource())
@@ -44,6 +44,7 @@ event_resource = EventResource()
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^api/', include(v1_api.urls)),
+    url(r'^metrics/?$', metrics, name='metrics'),
     url(r'^activate/(?P<uidb64>[0-9A-Za-z_\-]+)/(?P<token>[0-9A-Za-z]{1,13}-[0-9A-Za-z]{1,20})/$',
         activate, name='activate')
 ]